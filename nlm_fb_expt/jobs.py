@@ -0,0 +1,236 @@
+"""
+Background jobs for nlm_fb human baseline experiment.
+
+-----
+
+Slow external calls (MTurk qualifications, reCAPTCHA verification) are
+queued as Job rows by the views and run by the run_jobs worker command.
+Workers claim due jobs with SELECT ... FOR UPDATE SKIP LOCKED, so several
+can run at once; failed jobs are retried with jittered exponential backoff.
+
+Clients are created once per worker and reused. Point them at local stub
+services with the MTURK_ENDPOINT_URL and RECAPTCHA_URL settings.
+"""
+import json
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone as tz
+
+from nlm_fb.nlm_fb_expt.models import Job, Participant, ParticipantEvent
+from nlm_fb.secrets import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY
+
+"""
+Parameters
+----------
+"""
+
+RECAPTCHA_URL = "https://www.google.com/recaptcha/api/siteverify"
+QUALIFICATION_TYPE_ID = '3GNL8ZDCG6N1PUOYDZQY9HUQXUMIOJ'
+
+HTTP_TIMEOUT = 10  # seconds
+MAX_ATTEMPTS = 6
+BACKOFF = 2  # seconds, doubled each attempt
+MAX_BACKOFF = 600
+LEASE = timedelta(minutes=5)  # Running jobs are reclaimed after this
+FAILED_CAPTCHA_SCORE = 0  # Stored when a token can't be verified
+
+
+"""
+Clients
+-------
+"""
+
+_clients = {}
+
+
+def get_mturk_client():
+    """Shared MTurk client."""
+    if "mturk" not in _clients:
+        import boto3
+
+        _clients["mturk"] = boto3.client(
+            'mturk',
+            region_name="us-east-1",
+            aws_access_key_id=AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+            endpoint_url=getattr(settings, "MTURK_ENDPOINT_URL", None),
+        )
+
+    return _clients["mturk"]
+
+
+def get_session():
+    """Shared requests session (keeps connections alive)."""
+    if "http" not in _clients:
+        import requests
+
+        _clients["http"] = requests.Session()
+
+    return _clients["http"]
+
+
+"""
+Handlers
+--------
+"""
+
+
+def log_event(ppt_id, kind, data):
+    """Record an event for ppt (data is stored as JSON)."""
+    ParticipantEvent.objects.create(
+        participant_id=ppt_id, kind=kind, data=json.dumps(data, default=str))
+
+
+def grant_qualification(job, payload):
+    """Grant qualification to worker to prevent future HITs."""
+    ppt = Participant.objects.only("worker_id").get(pk=job.participant_id)
+    client = get_mturk_client()
+
+    # # Approve assignment
+    # approve_response = client.approve_assignment(
+    #     AssignmentId=ppt.assignment_id,
+    #     RequesterFeedback='Thanks again for your help',
+    #     OverrideRejection=False
+    # )
+
+    # Block future HITs
+    block_response = client.associate_qualification_with_worker(
+        QualificationTypeId=QUALIFICATION_TYPE_ID,
+        WorkerId=ppt.worker_id,
+        IntegerValue=1,
+        SendNotification=False
+    )
+
+    log_event(job.participant_id, "mturk_qualification", block_response)
+
+    block_status = block_response["ResponseMetadata"]["HTTPStatusCode"]
+    if block_status != 200:
+        raise RuntimeError(f"Qualification request returned {block_status}")
+
+
+def verify_captcha(job, payload):
+    """Verify a captcha token and store the ppt's score."""
+    data = {"response": payload.get("token"),
+            "secret": settings.CAPTCHA_SECRET_KEY}
+
+    response = get_session().post(
+        getattr(settings, "RECAPTCHA_URL", RECAPTCHA_URL), data=data,
+        timeout=getattr(settings, "HTTP_TIMEOUT", HTTP_TIMEOUT))
+    response.raise_for_status()
+
+    # Invalid tokens get success: false and no score
+    score = response.json().get('score')
+    if score is None:
+        score = FAILED_CAPTCHA_SCORE
+    Participant.objects.filter(pk=job.participant_id).update(
+        captcha_score=score, updated=tz.now())
+
+
+def fail_captcha(job, payload):
+    """Store a failing score when a token couldn't be verified at all."""
+    Participant.objects.filter(pk=job.participant_id).update(
+        captcha_score=FAILED_CAPTCHA_SCORE, updated=tz.now())
+
+
+HANDLERS = {
+    "mturk_qualification": grant_qualification,
+    "captcha": verify_captcha,
+}
+
+# Called when a job has failed for good
+FAILURE_HANDLERS = {
+    "captcha": fail_captcha,
+}
+
+
+"""
+Queue
+-----
+"""
+
+
+def enqueue(kind, ppt_id, **payload):
+    """Queue a job of kind for ppt."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: '{kind}'")
+
+    return Job.objects.create(kind=kind, participant_id=ppt_id,
+                              payload=json.dumps(payload))
+
+
+def claim(limit=10):
+    """Claim up to limit due jobs, leasing them to this worker.
+
+    Pending jobs are due once their run_after has passed; running jobs whose
+    lease has expired (e.g. their worker died) are claimed again.
+    """
+    now = tz.now()
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(Q(status="pending") | Q(status="running"), run_after__lte=now)
+            .order_by("run_after", "id")[:limit])
+
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status="running", run_after=now + LEASE)
+
+    return jobs
+
+
+def claim_for(ppt_id, kind):
+    """Claim ppt's unfinished jobs of kind, to run them now.
+
+    Pending jobs are claimed even if they're waiting to retry; running jobs
+    only once their lease has expired.
+    """
+    now = tz.now()
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(Q(status="pending") | Q(status="running", run_after__lte=now),
+                    participant_id=ppt_id, kind=kind))
+
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status="running", run_after=now + LEASE)
+
+    return jobs
+
+
+def backoff(attempts):
+    """Delay before retrying after attempts failures (full jitter)."""
+    delay = min(MAX_BACKOFF, BACKOFF * 2 ** (attempts - 1))
+    return timedelta(seconds=random.uniform(0, delay))
+
+
+def run(job, max_attempts=MAX_ATTEMPTS):
+    """Run a claimed job, then mark it done or schedule a retry.
+
+    Returns:
+        status (str): done, pending (will retry) or failed
+    """
+    try:
+        HANDLERS[job.kind](job, json.loads(job.payload))
+    except Exception as e:
+        attempts = job.attempts + 1
+        status = "failed" if attempts >= max_attempts else "pending"
+        Job.objects.filter(pk=job.pk).update(
+            status=status, attempts=attempts, last_error=repr(e),
+            run_after=tz.now() + backoff(attempts),
+            finished=tz.now() if status == "failed" else None)
+
+        if status == "failed":
+            log_event(job.participant_id, "job_failed",
+                      {"kind": job.kind, "error": repr(e)})
+            if job.kind in FAILURE_HANDLERS:
+                FAILURE_HANDLERS[job.kind](job, json.loads(job.payload))
+
+        return status
+
+    Job.objects.filter(pk=job.pk).update(
+        status="done", attempts=job.attempts + 1, finished=tz.now())
+
+    return "done"
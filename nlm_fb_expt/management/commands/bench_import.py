@@ -0,0 +1,67 @@
+"""Benchmark worker boot: import time of the app's views, and warm-up."""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Run in a fresh interpreter, as a new worker would
+BOOT_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+import django
+django.setup()
+t1 = time.perf_counter()
+from nlm_fb.nlm_fb_expt import urls, views
+t2 = time.perf_counter()
+views.warm_up()
+t3 = time.perf_counter()
+print(json.dumps({
+    "setup_ms": (t1 - t0) * 1000,
+    "import_ms": (t2 - t1) * 1000,
+    "warm_up_ms": (t3 - t2) * 1000,
+    "heavy": [m for m in %r if m in sys.modules],
+}))
+"""
+
+# Modules request handlers shouldn't need at import time
+HEAVY_MODULES = ["pandas", "boto3", "requests"]
+
+
+class Command(BaseCommand):
+    help = ("Time worker boot (django setup, views import and warm-up) "
+            "in fresh interpreters.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument("--max_ms", type=float, default=None,
+                            help="Fail if median boot time exceeds this.")
+
+    def handle(self, *args, **options):
+        script = BOOT_SCRIPT % (HEAVY_MODULES,)
+
+        runs = []
+        for _ in range(options["runs"]):
+            output = subprocess.run(
+                [sys.executable, "-c", script], env=os.environ.copy(),
+                capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.splitlines()[-1]))
+
+        for field in ["setup_ms", "import_ms", "warm_up_ms"]:
+            median = statistics.median(run[field] for run in runs)
+            self.stdout.write(f"{field}: {median:.1f}")
+
+        boot_ms = statistics.median(
+            run["setup_ms"] + run["import_ms"] + run["warm_up_ms"] for run in runs)
+        self.stdout.write(f"boot_ms: {boot_ms:.1f}")
+
+        heavy = sorted({m for run in runs for m in run["heavy"]})
+        if heavy:
+            raise CommandError(f"Heavy modules imported at boot: {', '.join(heavy)}")
+
+        if options["max_ms"] is not None and boot_ms > options["max_ms"]:
+            raise CommandError(
+                f"Boot took {boot_ms:.1f}ms (max {options['max_ms']:.1f}ms)")
@@ -0,0 +1,167 @@
+"""Benchmark hot lookups: seed a throwaway db, then check plans and timings."""
+import datetime
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone as tz
+
+from nlm_fb.nlm_fb_expt.models import (Participant, AttentionCheckTrial,
+                                       CriticalTrial)
+
+STUDIES = ["pilot", "test", "main", "main_2"]
+ITEMS = 40
+
+
+def seed(n_participants, batch_size=1000):
+    """Insert n_participants synthetic ppts, with 1 critical & 2 attn trials each."""
+    rng = random.Random(0)
+    start = tz.now() - datetime.timedelta(days=365)
+
+    for offset in range(0, n_participants, batch_size):
+        ppts = []
+        started = []
+        for i in range(offset, min(offset + batch_size, n_participants)):
+            started.append(start + datetime.timedelta(
+                seconds=rng.randrange(365 * 86400)))
+            ppts.append(Participant(
+                ip_address=f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+                worker_id=f"A{i:012d}", key=f"key-{i}",
+                study=rng.choice(STUDIES)))
+        ppts = Participant.objects.bulk_create(ppts)
+        if ppts[0].pk is None:
+            # Backends that don't return ids from bulk inserts
+            ppts = list(Participant.objects.order_by("id")[offset:offset + len(ppts)])
+
+        # start_time is auto_now_add, so spread ppts over the year afterwards
+        for ppt, start_time in zip(ppts, started):
+            ppt.start_time = start_time
+            ppt.end_time = start_time + datetime.timedelta(minutes=10)
+        Participant.objects.bulk_update(ppts, ["start_time", "end_time"])
+
+        critical, attn_checks = [], []
+        for ppt in ppts:
+            item = rng.randrange(ITEMS)
+            item_id = f"{item}_fb_1_s_e_ex"
+            critical.append(CriticalTrial(
+                participant=ppt, item_id=item_id, item=item, trial_index=3,
+                condition="False Belief", first_mention="Start",
+                recent_mention="End", knowledge_cue="Explicit",
+                start="garage", end="fridge", reaction_time=900,
+                passage_reading_time=1200))
+            for j in range(2):
+                attn_checks.append(AttentionCheckTrial(
+                    participant=ppt, item_id=item_id, item=item,
+                    trial_index=4 + j, question_id=f"attn_{j + 1}",
+                    reaction_time=800))
+        CriticalTrial.objects.bulk_create(critical)
+        AttentionCheckTrial.objects.bulk_create(attn_checks)
+
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+
+def lookups(n_participants):
+    """Hot lookups: (name, queryset, (model, columns of the index it should use))."""
+    i = n_participants // 2
+    start = Participant.objects.get(worker_id=f"A{i:012d}").start_time
+    end = start + datetime.timedelta(days=2)
+
+    return [
+        ("ppt by worker_id", Participant.objects.filter(worker_id=f"A{i:012d}"),
+         (Participant, ["worker_id"])),
+        ("ppt by key", Participant.objects.filter(key=f"key-{i}"),
+         (Participant, ["key"])),
+        ("ppt by ip_address", Participant.objects.filter(ip_address="10.0.0.1"),
+         (Participant, ["ip_address"])),
+        ("ppts by start/end", Participant.objects.filter(
+            start_time__gte=start, start_time__lt=end),
+         (Participant, ["start_time"])),
+        ("ppts by study & start/end", Participant.objects.filter(
+            study="main", start_time__gte=start, start_time__lt=end),
+         (Participant, ["study", "start_time"])),
+        ("critical by study & start/end", CriticalTrial.objects.filter(
+            participant__study="main", participant__start_time__gte=start,
+            participant__start_time__lt=end),
+         (Participant, ["study", "start_time"])),
+        ("critical by item_id", CriticalTrial.objects.filter(item_id="7_fb_1_s_e_ex"),
+         (CriticalTrial, ["item_id"])),
+        ("attn checks by item_id", AttentionCheckTrial.objects.filter(
+            item_id="7_fb_1_s_e_ex"),
+         (AttentionCheckTrial, ["item_id"])),
+    ]
+
+
+def index_names(model, columns):
+    """Names of model's indexes whose leading columns are columns."""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+
+        if connection.vendor == "sqlite":
+            # Unique constraints are backed by sqlite_autoindex_* indexes,
+            # which introspection doesn't name
+            cursor.execute(f"PRAGMA index_list({connection.ops.quote_name(table)})")
+            for name in [row[1] for row in cursor.fetchall()]:
+                cursor.execute(f"PRAGMA index_info({connection.ops.quote_name(name)})")
+                constraints[name] = {"index": True,
+                                     "columns": [row[2] for row in cursor.fetchall()]}
+
+    return [name for name, constraint in constraints.items()
+            if (constraint["index"] or constraint.get("unique"))
+            and constraint["columns"][:len(columns)] == columns]
+
+
+class Command(BaseCommand):
+    help = ("Seed a throwaway test database with synthetic ppts and trials, "
+            "then check the hot lookups use their indexes and time them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--participants", type=int, default=20000)
+        parser.add_argument("--runs", type=int, default=20)
+        parser.add_argument("--max_ms", type=float, default=None,
+                            help="Fail if a lookup's median time exceeds this.")
+
+    def handle(self, *args, **options):
+        n_participants = options["participants"]
+
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            t0 = time.perf_counter()
+            seed(n_participants)
+            self.stdout.write(f"Seeded {n_participants} ppts in "
+                              f"{time.perf_counter() - t0:.1f}s")
+
+            failures = self.bench(lookups(n_participants), options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if failures:
+            raise CommandError("\n".join(failures))
+
+    def bench(self, queries, options):
+        """Print each lookup's median time; return plan & timing failures."""
+        failures = []
+        for name, queryset, (model, columns) in queries:
+            plan = queryset.explain()
+            indexes = index_names(model, columns)
+            if not any(index in plan for index in indexes):
+                failures.append(f"{name}: no index on {model.__name__}"
+                                f"({', '.join(columns)}) in plan:\n{plan}")
+
+            times = []
+            for _ in range(options["runs"]):
+                t0 = time.perf_counter()
+                list(queryset.all())
+                times.append((time.perf_counter() - t0) * 1000)
+            median = statistics.median(times)
+            self.stdout.write(f"{name}: {median:.2f}ms")
+
+            if options["max_ms"] is not None and median > options["max_ms"]:
+                failures.append(f"{name}: took {median:.2f}ms "
+                                f"(max {options['max_ms']:.1f}ms)")
+
+        return failures
@@ -0,0 +1,16 @@
+"""Compile the expt stimuli csv into the json artifact served by views."""
+from django.core.management.base import BaseCommand
+
+from nlm_fb.nlm_fb_expt import views
+
+
+class Command(BaseCommand):
+    help = "Compile the expt stimuli csv into the json artifact served by views."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--csv", default=views.STIMULI_CSV_PATH)
+        parser.add_argument("--out", default=views.STIMULI_PATH)
+
+    def handle(self, *args, **options):
+        n = views.compile_stimuli(options["csv"], options["out"])
+        self.stdout.write(f"Compiled {n} items to {options['out']}")
@@ -0,0 +1,107 @@
+"""Rebuild participants and trials from the results log."""
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone as tz
+from django.utils.dateparse import parse_datetime
+
+from nlm_fb.nlm_fb_expt import views
+from nlm_fb.nlm_fb_expt.models import (Participant, AttentionCheckTrial,
+                                       CriticalTrial, ParticipantEvent)
+from nlm_fb.nlm_fb_expt.results_log import ResultsLog
+
+
+class Command(BaseCommand):
+    help = ("Bulk rebuild Participant, CriticalTrial and AttentionCheckTrial "
+            "rows from the results log. Participants that already have trials "
+            "are skipped unless --replace is given.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", default=views.RESULTS_DIR)
+        parser.add_argument("--replace", action="store_true",
+                            help="Replace trials of participants already stored.")
+        parser.add_argument("--dry_run", action="store_true")
+        parser.add_argument("--batch_size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        log = ResultsLog(options["dir"])
+
+        # Last submission per ppt
+        submissions = {}
+        for record in log.records():
+            post = record["post"]
+            submissions[int(post["ppt_id"])] = (record["timestamp"], post["results"])
+        self.stdout.write(f"#submissions: {len(submissions)}")
+
+        ppt_ids = list(submissions)
+        existing = set(Participant.objects.filter(
+            pk__in=ppt_ids).values_list("pk", flat=True))
+        with_trials = set(CriticalTrial.objects.filter(
+            participant_id__in=ppt_ids).values_list("participant_id", flat=True))
+
+        if options["replace"]:
+            replay_ids = ppt_ids
+        else:
+            replay_ids = [ppt_id for ppt_id in ppt_ids if ppt_id not in with_trials]
+        missing = [ppt_id for ppt_id in replay_ids if ppt_id not in existing]
+
+        self.stdout.write(f"#participants to replay: {len(replay_ids)} "
+                          f"({len(missing)} missing from db)")
+        if options["dry_run"]:
+            return
+
+        new_ppts = []
+        updates = {}
+        critical_trials = []
+        attn_check_trials = []
+        for ppt_id in replay_ids:
+            timestamp, data = submissions[ppt_id]
+            fields = views.demographics_fields(data)
+            fields.update(views.debrief_fields(data))
+            fields["end_time"] = parse_datetime(timestamp)
+            fields["updated"] = tz.now()
+
+            if ppt_id in existing:
+                updates[ppt_id] = fields
+            else:
+                new_ppts.append(Participant(pk=ppt_id, **fields))
+
+            critical, attn_checks = views.build_trials(data, Participant(pk=ppt_id))
+            critical_trials += critical
+            attn_check_trials += attn_checks
+
+        batch_size = options["batch_size"]
+        with transaction.atomic():
+            CriticalTrial.objects.filter(participant_id__in=replay_ids).delete()
+            AttentionCheckTrial.objects.filter(participant_id__in=replay_ids).delete()
+
+            self.create_participants(new_ppts, batch_size)
+            ParticipantEvent.objects.bulk_create(
+                [ParticipantEvent(participant_id=ppt.pk, kind="replayed")
+                 for ppt in new_ppts], batch_size=batch_size)
+            for ppt_id, fields in updates.items():
+                Participant.objects.filter(pk=ppt_id).update(**fields)
+
+            CriticalTrial.objects.bulk_create(critical_trials, batch_size=batch_size)
+            AttentionCheckTrial.objects.bulk_create(attn_check_trials, batch_size=batch_size)
+
+            # Participants were created with explicit ids
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Participant]):
+                    cursor.execute(sql)
+
+        self.stdout.write(f"Replayed {len(critical_trials)} critical and "
+                          f"{len(attn_check_trials)} attention check trials")
+
+    def create_participants(self, ppts, batch_size):
+        """Bulk create ppts with new keys, redrawing them if any collide."""
+        for attempt in range(views.KEY_ATTEMPTS):
+            for ppt in ppts:
+                ppt.key = views.generate_key()
+            try:
+                with transaction.atomic():
+                    Participant.objects.bulk_create(ppts, batch_size=batch_size)
+                return
+            except IntegrityError:
+                if attempt == views.KEY_ATTEMPTS - 1:
+                    raise
@@ -0,0 +1,33 @@
+"""Run queued background jobs (MTurk qualifications, captcha checks)."""
+import time
+
+from django.core.management.base import BaseCommand
+
+from nlm_fb.nlm_fb_expt import jobs
+
+
+class Command(BaseCommand):
+    help = ("Run queued background jobs. Run several workers for more "
+            "throughput; each claims different jobs.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=10,
+                            help="Jobs to claim at a time.")
+        parser.add_argument("--poll", type=float, default=1.0,
+                            help="Seconds to wait when no jobs are due.")
+        parser.add_argument("--max_attempts", type=int, default=jobs.MAX_ATTEMPTS)
+        parser.add_argument("--once", action="store_true",
+                            help="Exit when no jobs are due.")
+
+    def handle(self, *args, **options):
+        while True:
+            claimed = jobs.claim(options["batch"])
+            if not claimed:
+                if options["once"]:
+                    return
+                time.sleep(options["poll"])
+                continue
+
+            for job in claimed:
+                status = jobs.run(job, options["max_attempts"])
+                self.stdout.write(f"{job.kind} #{job.pk} (ppt {job.participant_id}): {status}")
@@ -0,0 +1,35 @@
+# Generated by Django 3.1.1 on 2026-10-18 09:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nlm_fb_expt', '0008_participant_study'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('study', models.CharField(max_length=80)),
+                ('item_id', models.CharField(max_length=80)),
+                ('assigned', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='participant',
+            name='item_id',
+            field=models.CharField(default='', max_length=80),
+        ),
+        migrations.AddIndex(
+            model_name='itemcounter',
+            index=models.Index(fields=['study', 'assigned'], name='nlm_fb_expt_study_4d7f51_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='itemcounter',
+            unique_together={('study', 'item_id')},
+        ),
+    ]
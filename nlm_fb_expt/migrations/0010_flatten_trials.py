@@ -0,0 +1,128 @@
+# Flatten Trial's multi-table inheritance into one table per trial type
+
+from django.core.management.color import no_style
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+TRIAL_FIELDS = ["participant_id", "item_id", "item", "item_type",
+                "trial_index", "correct_answer", "response", "is_correct",
+                "reaction_time"]
+
+TRIAL_TYPES = [
+    ("AttentionCheckTrial", "FlatAttentionCheckTrial",
+     TRIAL_FIELDS + ["question_id"]),
+    ("CriticalTrial", "FlatCriticalTrial",
+     TRIAL_FIELDS + ["condition", "first_mention", "recent_mention",
+                     "knowledge_cue", "start", "end", "is_start", "is_end",
+                     "passage_reading_time"]),
+]
+
+
+def copy_trials(apps, schema_editor, from_index, to_index):
+    """Copy every trial between the MTI and flat models, keeping ids.
+
+    Trial ids are referenced by the cleaned data (data/clean), so they're
+    copied across and the id sequences reset afterwards.
+    """
+    connection = schema_editor.connection
+    used_ids = set()
+    targets = []
+    for names in TRIAL_TYPES:
+        fields = ["id"] + names[2]
+        source = apps.get_model("nlm_fb_expt", names[from_index])
+        target = apps.get_model("nlm_fb_expt", names[to_index])
+
+        trials = [target(**{f: getattr(trial, f) for f in fields})
+                  for trial in source.objects.order_by("pk").iterator()]
+
+        if to_index == 0:
+            # MTI trials share the Trial table's ids: flat trials added
+            # since flattening may clash, and get new ids
+            for trial in trials:
+                if trial.id in used_ids:
+                    trial.id = None
+                used_ids.add(trial.id)
+            # MTI children need their parent row, so can't be bulk created
+            for trial in trials:
+                trial.save()
+            targets.append(apps.get_model("nlm_fb_expt", "Trial"))
+        else:
+            target.objects.bulk_create(trials, batch_size=500)
+            targets.append(target)
+
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), targets):
+            cursor.execute(sql)
+
+
+def flatten(apps, schema_editor):
+    copy_trials(apps, schema_editor, 0, 1)
+
+
+def unflatten(apps, schema_editor):
+    copy_trials(apps, schema_editor, 1, 0)
+
+
+def trial_fields():
+    return [
+        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+        ('item_id', models.CharField(max_length=80)),
+        ('item', models.IntegerField()),
+        ('trial_index', models.IntegerField()),
+        ('correct_answer', models.TextField(blank=True, default='')),
+        ('response', models.TextField(blank=True, default='')),
+        ('is_correct', models.BooleanField(blank=True, null=True)),
+        ('reaction_time', models.FloatField()),
+        ('participant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='nlm_fb_expt.participant')),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nlm_fb_expt', '0009_itemcounter_participant_item_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlatAttentionCheckTrial',
+            fields=trial_fields() + [
+                ('item_type', models.CharField(default='attention_check', max_length=80)),
+                ('question_id', models.CharField(max_length=80)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FlatCriticalTrial',
+            fields=trial_fields() + [
+                ('item_type', models.CharField(default='critical', max_length=80)),
+                ('condition', models.CharField(max_length=80)),
+                ('first_mention', models.CharField(max_length=80)),
+                ('recent_mention', models.CharField(max_length=80)),
+                ('knowledge_cue', models.CharField(max_length=80)),
+                ('start', models.CharField(max_length=80)),
+                ('end', models.CharField(max_length=80)),
+                ('is_start', models.BooleanField(blank=True, null=True)),
+                ('is_end', models.BooleanField(blank=True, null=True)),
+                ('passage_reading_time', models.FloatField()),
+            ],
+        ),
+        migrations.RunPython(flatten, unflatten),
+        migrations.DeleteModel(
+            name='AttentionCheckTrial',
+        ),
+        migrations.DeleteModel(
+            name='CriticalTrial',
+        ),
+        migrations.DeleteModel(
+            name='Trial',
+        ),
+        migrations.RenameModel(
+            old_name='FlatAttentionCheckTrial',
+            new_name='AttentionCheckTrial',
+        ),
+        migrations.RenameModel(
+            old_name='FlatCriticalTrial',
+            new_name='CriticalTrial',
+        ),
+    ]
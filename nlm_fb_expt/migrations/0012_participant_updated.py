@@ -0,0 +1,18 @@
+# Generated by Django 3.1.1 on 2026-10-18 09:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nlm_fb_expt', '0011_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.1.1 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nlm_fb_expt', '0012_participant_updated'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attentionchecktrial',
+            name='item_id',
+            field=models.CharField(db_index=True, max_length=80),
+        ),
+        migrations.AlterField(
+            model_name='criticaltrial',
+            name='item_id',
+            field=models.CharField(db_index=True, max_length=80),
+        ),
+        migrations.AlterField(
+            model_name='participant',
+            name='ip_address',
+            field=models.TextField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='participant',
+            name='key',
+            field=models.CharField(db_index=True, max_length=80),
+        ),
+        migrations.AlterField(
+            model_name='participant',
+            name='start_time',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='participant',
+            name='worker_id',
+            field=models.TextField(db_index=True, default=''),
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['study', 'start_time'], name='nlm_fb_expt_study_624081_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.1.1 on 2026-10-18 10:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nlm_fb_expt', '0013_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParticipantEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=40)),
+                ('data', models.TextField(default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('participant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='nlm_fb_expt.participant')),
+            ],
+        ),
+    ]
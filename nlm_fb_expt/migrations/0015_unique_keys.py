@@ -0,0 +1,67 @@
+# Make ppt keys unique, rekeying ppts who share a key first
+
+import json
+import random
+
+from django.db import migrations, models
+
+from nlm_fb.data.expt.words import wordlist
+
+KEY_WORDS = 3
+
+
+def new_key(rng, taken):
+    while True:
+        key = "-".join(rng.choice(wordlist) for _ in range(KEY_WORDS))
+        if key not in taken:
+            taken.add(key)
+            return key
+
+
+def rekey_duplicates(apps, schema_editor):
+    """Give every ppt but the first with each shared key a new key.
+
+    The old key is kept in a rekeyed event, so credit can still be traced.
+    """
+    Participant = apps.get_model("nlm_fb_expt", "Participant")
+    ParticipantEvent = apps.get_model("nlm_fb_expt", "ParticipantEvent")
+
+    duplicates = set(Participant.objects.values("key")
+                     .annotate(n=models.Count("id")).filter(n__gt=1)
+                     .values_list("key", flat=True))
+    if not duplicates:
+        return
+
+    rng = random.SystemRandom()
+    taken = set(Participant.objects.values_list("key", flat=True))
+    seen = set()
+    rekeyed = []
+    events = []
+    for ppt in (Participant.objects.filter(key__in=duplicates)
+                .order_by("id").only("id", "key")):
+        if ppt.key not in seen:
+            seen.add(ppt.key)
+            continue
+        events.append(ParticipantEvent(participant_id=ppt.pk, kind="rekeyed",
+                                       data=json.dumps(ppt.key)))
+        ppt.key = new_key(rng, taken)
+        rekeyed.append(ppt)
+
+    Participant.objects.bulk_update(rekeyed, ["key"], batch_size=500)
+    ParticipantEvent.objects.bulk_create(events, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nlm_fb_expt', '0014_participantevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(rekey_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='participant',
+            name='key',
+            field=models.CharField(max_length=80, unique=True),
+        ),
+    ]
@@ -1,19 +1,21 @@
 """Database models for nlm-fb project."""
 
 from django.db import models
+from django.utils import timezone as tz
 
 
 class Participant(models.Model):
     """Class to store participant data."""
 
     # Identify ppt
-    ip_address = models.TextField()
-    worker_id = models.TextField(default="")  # Amazon Mechanical Turk Worker Id
+    ip_address = models.TextField(db_index=True)
+    worker_id = models.TextField(default="", db_index=True)  # Amazon Mechanical Turk Worker Id
     assignment_id = models.TextField(default="")  # MTurk Assignment Id
     get_args = models.TextField(default="")  # Get args issued with request
-    notes = models.TextField(default="")  # Miscellaneous notes
-    key = models.CharField(max_length=80)  # Key for granting credit
+    notes = models.TextField(default="")  # Misc notes (see ParticipantEvent)
+    key = models.CharField(max_length=80, unique=True)  # Key for granting credit
     study = models.CharField(max_length=80)  # Pilot? Test? Main?
+    item_id = models.CharField(max_length=80, default="")  # Item assigned
 
     # Device
     ua_header = models.TextField(default="")
@@ -24,8 +26,9 @@ class Participant(models.Model):
     captcha_score = models.FloatField(blank=True, null=True)
 
     # Experiment
-    start_time = models.DateTimeField(auto_now_add=True)
+    start_time = models.DateTimeField(auto_now_add=True, db_index=True)
     end_time = models.DateTimeField(blank=True, null=True)
+    updated = models.DateTimeField(auto_now=True)  # Set on QuerySet.update too
 
     # Demographics
     birth_year = models.IntegerField(blank=True, null=True)
@@ -41,9 +44,62 @@ class Participant(models.Model):
     post_test_purpose = models.TextField(default="")
     post_test_other = models.TextField(default="")
 
+    class Meta:
+        indexes = [models.Index(fields=["study", "start_time"])]
+
+
+class ParticipantEvent(models.Model):
+    """Something that happened to a ppt (ua data, MTurk responses, ...).
+
+    Append-only: written with single INSERTs rather than rewriting notes.
+    """
+
+    participant = models.ForeignKey(
+        Participant,
+        on_delete=models.CASCADE
+    )
+    kind = models.CharField(max_length=40)  # ua_data, repeat_ip, ...
+    data = models.TextField(default="")  # JSON
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class ItemCounter(models.Model):
+    """Number of ppts assigned each item (item/condition) in a study."""
+
+    study = models.CharField(max_length=80)
+    item_id = models.CharField(max_length=80)
+    assigned = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [("study", "item_id")]
+        indexes = [models.Index(fields=["study", "assigned"])]
+
+
+class Job(models.Model):
+    """Background job for a ppt, run by the run_jobs worker (see jobs.py)."""
+
+    kind = models.CharField(max_length=40)  # Handler name
+    participant = models.ForeignKey(
+        Participant,
+        on_delete=models.CASCADE
+    )
+    payload = models.TextField(default="{}")  # JSON handler args
+    status = models.CharField(max_length=20, default="pending")
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=tz.now)  # Retry/lease time
+    last_error = models.TextField(default="")
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "run_after"])]
+
 
 class Trial(models.Model):
-    """Responses to nlm_fb trial questions."""
+    """Responses to nlm_fb trial questions.
+
+    Abstract, so each trial type is a single table and can be bulk inserted.
+    """
 
     participant = models.ForeignKey(
         Participant,
@@ -51,7 +107,7 @@ class Trial(models.Model):
     )
 
     # Item identifier
-    item_id = models.CharField(max_length=80)  # Unique item ID
+    item_id = models.CharField(max_length=80, db_index=True)  # Unique item ID
     item = models.IntegerField()  # Item Template Id
     item_type = models.CharField(  # critical/attention_check
         max_length=80)
@@ -63,11 +119,14 @@ class Trial(models.Model):
     is_correct = models.BooleanField(blank=True, null=True)
     reaction_time = models.FloatField()  # RT in ms
 
+    class Meta:
+        abstract = True
+
 
 class AttentionCheckTrial(Trial):
     """Responses to attention check questions."""
 
-    item_type = "attention_check"
+    item_type = models.CharField(max_length=80, default="attention_check")
     question_id = models.CharField(max_length=80)  # Attn question type
 
 
@@ -75,7 +134,7 @@ class CriticalTrial(Trial):
     """Responses to critical questions."""
 
     # Item data
-    item_type = "critical"
+    item_type = models.CharField(max_length=80, default="critical")
     condition = models.CharField(max_length=80)  # T/F Belief
     first_mention = models.CharField(max_length=80)
     recent_mention = models.CharField(max_length=80)
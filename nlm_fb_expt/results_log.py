@@ -0,0 +1,157 @@
+"""
+Append-only results log for nlm_fb human baseline experiment.
+
+-----
+
+Raw submissions are appended to compressed JSONL segments:
+
+    {directory}/results-{YYYY-MM-DD}-{n:03d}.jsonl.gz
+
+Each append is written as its own gzip member (concatenated members are a
+valid gzip file) under an exclusive flock, so several workers can append
+to the same segment safely. Segments rotate daily and once they reach
+max_bytes. Appends are fsynced in batches: every fsync_every appends or
+fsync_interval seconds, whichever comes first (and at exit).
+
+A failed write is truncated away before the lock is released, and records()
+skips any member that still turns out corrupt (resyncing on the next gzip
+header), so one bad append never hides the records after it.
+"""
+import atexit
+import fcntl
+import glob
+import gzip
+import json
+import os
+import time
+import zlib
+
+from django.utils import timezone as tz
+
+# Header of every member append writes (gzip.compress with mtime=0)
+GZIP_HEADER = gzip.compress(b"", mtime=0)[:10]
+READ_BLOCK = 4096  # Bytes fed to the decompressor at a time
+
+
+class ResultsLog:
+    """Rotating, compressed, append-only JSONL log of submissions.
+
+    Args:
+        directory (str): Directory holding the segments
+        max_bytes (int): Rotate segments at about this size
+        fsync_every (int): fsync after this many appends
+        fsync_interval (float): ... or this many seconds since the last
+    """
+
+    def __init__(self, directory, max_bytes=64 * 2**20, fsync_every=20,
+                 fsync_interval=5.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        self._path = None
+        self._fd = None
+        self._pending = 0
+        self._synced = time.monotonic()
+
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.flush)
+
+    def segments(self):
+        """Segment paths, oldest first."""
+        return sorted(glob.glob(os.path.join(self.directory, "results-*.jsonl.gz")))
+
+    def _segment(self):
+        """Open the segment to append to, rotating if needed (lock held)."""
+        today = tz.now().strftime("%Y-%m-%d")
+        if (self._fd is not None and today in self._path
+                and os.fstat(self._fd).st_size < self.max_bytes):
+            return self._fd
+
+        # Rotating: sync what we've written to the old segment
+        self.flush()
+        if self._fd is not None:
+            os.close(self._fd)
+
+        paths = sorted(glob.glob(os.path.join(
+            self.directory, f"results-{today}-*.jsonl.gz")))
+        n = len(paths)
+        if paths and os.path.getsize(paths[-1]) < self.max_bytes:
+            n -= 1
+
+        self._path = os.path.join(self.directory, f"results-{today}-{n:03d}.jsonl.gz")
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return self._fd
+
+    def append(self, record):
+        """Append record (a JSON-serialisable dict)."""
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        member = gzip.compress(line.encode("utf-8"), mtime=0)
+
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            fd = self._segment()
+            size = os.fstat(fd).st_size
+            try:
+                data = memoryview(member)
+                while data:
+                    data = data[os.write(fd, data):]
+            except OSError:
+                # Don't leave a partial member for others to append after
+                os.ftruncate(fd, size)
+                raise
+
+        self._pending += 1
+        if (self._pending >= self.fsync_every
+                or time.monotonic() - self._synced >= self.fsync_interval):
+            self.flush()
+
+    def flush(self):
+        """fsync appends to the current segment."""
+        if self._fd is not None and self._pending:
+            os.fsync(self._fd)
+        self._pending = 0
+        self._synced = time.monotonic()
+
+    def records(self):
+        """Every record in the log, oldest first.
+
+        Corrupt members (e.g. from a crash mid-append) are skipped.
+        """
+        for path in self.segments():
+            with open(path, "rb") as f:
+                data = f.read()
+
+            for member in _members(data):
+                for line in member.decode("utf-8", "replace").splitlines():
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+
+def _members(data):
+    """Decompressed members of concatenated gzip data, skipping bad ones."""
+    view = memoryview(data)
+    pos = 0
+    while pos < len(data):
+        start = pos
+        decompressor = zlib.decompressobj(wbits=31)
+        chunks = []
+        try:
+            while not decompressor.eof:
+                if pos >= len(data):
+                    raise zlib.error("Truncated member")
+                block = view[pos:pos + READ_BLOCK]
+                chunks.append(decompressor.decompress(block))
+                pos += len(block)
+        except zlib.error:
+            # Resync on the next member
+            pos = data.find(GZIP_HEADER, start + 1)
+            if pos == -1:
+                return
+            continue
+
+        pos -= len(decompressor.unused_data)
+        yield b"".join(chunks)
@@ -0,0 +1,173 @@
+"""
+Duplicate participant screening for nlm_fb human baseline experiment.
+
+-----
+
+expt() checks arriving MTurk workers (and ip addresses) against every ppt
+seen before; reloads of a worker's unfinished assignment are let through.
+Each worker process keeps Bloom filters of the worker_ids and ips in the
+Participant table: built once, topped up with newer ppts (by id)
+at most every REFRESH_INTERVAL seconds, and rebuilt every REBUILD_INTERVAL
+(to pick up worker_ids stored after a ppt was created).
+
+Most arrivals are new, and a filter miss answers them without touching the
+db. A hit is confirmed with an indexed lookup, so false positives never
+reject anyone.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.db.models import Q
+
+from nlm_fb.nlm_fb_expt.models import Participant
+
+"""
+Parameters
+----------
+"""
+
+CAPACITY = 100000  # Ppts the filters are sized for (they grow past this)
+ERROR_RATE = 0.001  # False positive rate at capacity
+REFRESH_INTERVAL = 5  # seconds
+REBUILD_INTERVAL = 3600  # seconds
+
+
+"""
+Bloom filter
+------------
+"""
+
+
+class BloomFilter:
+    """Set membership with no false negatives, in ~1.8 bytes per value.
+
+    Args:
+        capacity (int): Number of values to size the filter for
+        error_rate (float): False positive rate at capacity
+    """
+
+    def __init__(self, capacity=CAPACITY, error_rate=ERROR_RATE):
+        self.capacity = capacity
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        """Bit positions of value (double hashing)."""
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(value))
+
+
+"""
+Screen
+------
+"""
+
+
+class Screen:
+    """Worker_ids and ips of every ppt, kept in step with the db."""
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.workers = self.ips = None
+        self.last_id = 0
+        self.refreshed = self.rebuilt = 0
+
+    def add(self, worker_id, ip_address):
+        if self.workers is None:
+            return
+        if worker_id:
+            self.workers.add(worker_id)
+        if ip_address:
+            self.ips.add(ip_address)
+
+    def refresh(self, force=False):
+        """Load ppts created since the last refresh (or all, to rebuild)."""
+        now = time.monotonic()
+        if not force and now - self.refreshed < REFRESH_INTERVAL:
+            return
+
+        with self.lock:
+            if not force and now - self.refreshed < REFRESH_INTERVAL:
+                return
+
+            rebuild = (force or self.workers is None
+                       or now - self.rebuilt >= REBUILD_INTERVAL
+                       or self.ips.count > self.ips.capacity)
+            if rebuild:
+                capacity = max(self.capacity,
+                               2 * self.ips.count if self.ips else 0)
+                workers, ips = BloomFilter(capacity), BloomFilter(capacity)
+                last_id = 0
+            else:
+                workers, ips, last_id = self.workers, self.ips, self.last_id
+
+            rows = (Participant.objects.filter(id__gt=last_id).order_by("id")
+                    .values_list("id", "worker_id", "ip_address"))
+            for ppt_id, worker_id, ip_address in rows.iterator(chunk_size=5000):
+                if worker_id:
+                    workers.add(worker_id)
+                if ip_address:
+                    ips.add(ip_address)
+                last_id = ppt_id
+
+            # Swap in rebuilt filters whole, so checks never see them half-built
+            self.workers, self.ips, self.last_id = workers, ips, last_id
+            self.refreshed = now
+            if rebuild:
+                self.rebuilt = now
+
+
+_screen = Screen()
+
+
+def refresh(force=False):
+    """Bring the filters up to date (see Screen.refresh)."""
+    _screen.refresh(force)
+
+
+def seen_worker(worker_id, assignment_id=""):
+    """Whether worker_id has participated before.
+
+    Earlier ppts with worker_id count if they finished, or were for a
+    different assignment; reloading the page of an unfinished assignment
+    doesn't.
+    """
+    if not worker_id:
+        return False
+
+    _screen.refresh()
+    return (worker_id in _screen.workers
+            and Participant.objects.filter(worker_id=worker_id).filter(
+                Q(end_time__isnull=False) | ~Q(assignment_id=assignment_id))
+            .exists())
+
+
+def seen_ip(ip_address):
+    """Whether a ppt with ip_address has been seen before."""
+    if not ip_address:
+        return False
+
+    _screen.refresh()
+    return (ip_address in _screen.ips
+            and Participant.objects.filter(ip_address=ip_address).exists())
+
+
+def add(worker_id, ip_address):
+    """Record a new ppt's worker_id and ip (this process's filters)."""
+    _screen.add(worker_id, ip_address)
@@ -130,23 +130,50 @@ function close_captcha() {
   }
 }
 
-function validate_captcha(token) {
+function validate_captcha(token, sync = false) {
   // console.log(`validate_captcha(${token})`)
   let url = `/${module_url}/validate_captcha/`;
   let csrftoken = Cookies.get('csrftoken');
   let headers = {"X-CSRFToken": csrftoken};
   let data = {
     token: token,
-    ppt_id: conf.ppt_id
+    ppt_id: conf.ppt_id,
+    sync: sync
   };
   axios.post(url, data, {headers: headers})
     .then(response => {
       // console.log(response.data);
-      if (response.data.score > 0.2) {
-        close_captcha();
-        // jsPsych.finishTrial(response.data)
+      if (response.data.queued) {
+        // Token is verified in the background
+        check_captcha(1000);
       } else {
-        window.location.href = `/${module_url}/error`;
+        handle_captcha_score(response.data.score);
+      }
+    });
+}
+
+function handle_captcha_score(score) {
+  // No score (e.g. the token couldn't be verified) fails too
+  if (score !== null && score > 0.2) {
+    close_captcha();
+    // jsPsych.finishTrial(response.data)
+  } else {
+    window.location.href = `/${module_url}/error`;
+  }
+}
+
+function check_captcha(delay) {
+  // Poll for the background captcha score, backing off up to ~30s
+  let url = `/${module_url}/captcha_status/`;
+  axios.get(url, {params: {ppt_id: conf.ppt_id}})
+    .then(response => {
+      if (response.data.score !== null) {
+        handle_captcha_score(response.data.score);
+      } else if (delay < 16000) {
+        setTimeout(() => check_captcha(delay * 2), delay);
+      } else {
+        // Timed out: verify now instead
+        validate_captcha(null, true);
       }
     });
 }
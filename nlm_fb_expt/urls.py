@@ -8,7 +8,10 @@ urlpatterns = [
     path('expt', views.expt),
     path('save_results/', views.save_results),
     path('validate_captcha/', views.validate_captcha),
+    path('captcha_status/', views.captcha_status),
     path('ua_data/', views.ua_data),
     path('error', views.error),
+    path('ready/', views.ready),
     path('data/<str:model>/', views.download_data),
+    path('key/', views.key_lookup),
 ]
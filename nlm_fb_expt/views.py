@@ -3,24 +3,38 @@ Views for nlm_fb human baseline experiment.
 
 -----
 
+Heavy dependencies (boto3, requests) are imported inside the
+functions that use them, so workers boot without loading them. Calls to
+MTurk and reCAPTCHA are queued as background jobs (see jobs.py).
 """
 import os
+import csv
 import json
+import datetime
+import hashlib
 import random
-import requests
+import re
+import threading
+import zipfile
 
-import pandas as pd
+from django.db import IntegrityError, transaction
+from django.db.models import F, Count, Max
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponse
+from django.http import (JsonResponse, Http404, HttpResponseBadRequest,
+                         StreamingHttpResponse)
 from django.utils import timezone as tz
+from django.utils.dateparse import parse_date, parse_datetime
 from django.conf import settings
 from django.contrib.auth.decorators import user_passes_test
-import boto3
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 
+from nlm_fb.nlm_fb_expt import jobs, screening
 from nlm_fb.nlm_fb_expt.models import (Participant, AttentionCheckTrial,
-                                       CriticalTrial)
+                                       CriticalTrial, ItemCounter,
+                                       ParticipantEvent)
+from nlm_fb.nlm_fb_expt.results_log import ResultsLog
 from nlm_fb.data.expt.words import wordlist
-from nlm_fb.secrets import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY
 
 """
 Parameters
@@ -30,58 +44,64 @@ Parameters
 # General parameters
 MODULE_PATH = "nlm_fb/nlm_fb_expt"
 MODULE_URL = "nlm_fb"
-RESULTS_DIR = "nlm_fb/data/results/"  # Store responses
+RESULTS_DIR = "nlm_fb/data/results/"  # Results log (raw responses)
 
-RECAPTCHA_URL = "https://www.google.com/recaptcha/api/siteverify"
+STIMULI_CSV_PATH = "nlm_fb/data/expt/nlm_fb_stimuli.csv"
+STIMULI_PATH = "nlm_fb/data/expt/nlm_fb_stimuli.json"  # compile_stimuli
+
+# Ppt keys: KEY_WORDS random words (~7e9 keys), unique in the db
+KEY_WORDS = 3
+KEY_ATTEMPTS = 5  # Keys to try before giving up on creating a ppt
+KEY_LOOKUP_BATCH = 500  # Keys per query in bulk lookups
+
+# Reject MTurk workers who've participated before (repeat ips are noted)
+SCREEN_DUPLICATES = getattr(settings, "SCREEN_DUPLICATES", True)
 
 MODELS = {
     "participant": Participant,
     "critical": CriticalTrial,
-    "attention_check": AttentionCheckTrial
+    "attention_check": AttentionCheckTrial,
+    "event": ParticipantEvent,
 }
 
+# Data downloads
+EXPORT_CHUNK_SIZE = 2000  # Rows fetched per query
+EXPORT_BUFFER_SIZE = 2**16  # Bytes of zip output buffered before sending
+
 
 """
 Utils
 """
 
 
-def generate_key():
-    """Generate ppt key."""
-    return random.choice(wordlist)
+_random = random.SystemRandom()
 
 
-"""
-Load stimuli
-"""
+def generate_key():
+    """Generate ppt key (e.g. "river-able-account")."""
+    return "-".join(_random.choice(wordlist) for _ in range(KEY_WORDS))
 
 
-def load_item(item_id):
-    """Load data for a specific item.
+def normalize_key(key):
+    """Key as stored, from how a ppt might type it ("River Able account")."""
+    return "-".join(re.split(r"[\s_-]+", key.strip().lower()))
 
-    Args:
-        item_id (str): Item id for item
 
-    Returns:
-        item_data (dict): passage, critical, & attn check q's
+"""
+Load stimuli
+"""
 
-    Raises:
-        ValueError: Description
-    """
-    stimuli = pd.read_csv("nlm_fb/data/expt/nlm_fb_stimuli.csv")
-    row = stimuli[stimuli["item_id"] == item_id]
+# Stimuli keyed by item_id, and the (csv, json) mtimes they were loaded at.
+# Loaded once per worker, and reloaded when either file changes.
+_stimuli = (None, {})
+_stimuli_lock = threading.Lock()
 
-    if len(row) != 1:
-        raise ValueError(f"item_id: '{item_id}' is invalid")
-        # TODO: Generate random id if id doesn't match
-        # Log error etc
-    else:
-        row = row.iloc[0]
 
-    # Assemble data needed for expt
-    item_data = {
+def parse_item(row):
+    """Assemble the data needed for expt from a stimuli csv row."""
+    return {
         # Item data
-        "item_id": item_id,
+        "item_id": row["item_id"],
         "item": int(row["item"]),
         "condition": row["condition"],
         "first_mention": row["first_mention"],
@@ -104,7 +124,109 @@ def load_item(item_id):
         "attn_check_2_a": row["attn_check_2_a"]
     }
 
-    return item_data
+
+def read_stimuli_csv(path=STIMULI_CSV_PATH):
+    """Parse stimuli csv into item data keyed by item_id."""
+    with open(path, newline="") as f:
+        return {row["item_id"]: parse_item(row) for row in csv.DictReader(f)}
+
+
+def stimuli_csv_hash(path=STIMULI_CSV_PATH):
+    """sha256 of the stimuli csv, which compiled stimuli are checked against."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def compile_stimuli(csv_path=STIMULI_CSV_PATH, path=STIMULI_PATH):
+    """Compile stimuli csv into the json artifact load_stimuli serves.
+
+    The artifact records the csv's hash, so it's only served while it
+    matches the csv it was compiled from.
+
+    Returns:
+        n (int): Number of items compiled
+    """
+    items = read_stimuli_csv(csv_path)
+    with open(path, "w") as f:
+        json.dump({"csv_sha256": stimuli_csv_hash(csv_path), "items": items}, f)
+
+    return len(items)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _read_stimuli():
+    """Compiled stimuli if they match the csv's hash, else the csv's."""
+    try:
+        with open(STIMULI_PATH) as f:
+            compiled = json.load(f)
+    except FileNotFoundError:
+        compiled = {}
+
+    # Stale (or pre-hash) artifacts, e.g. the csv was changed without
+    # re-running compile_stimuli; mtimes can't tell (git doesn't keep them)
+    if compiled.get("csv_sha256") == stimuli_csv_hash():
+        return compiled["items"]
+    return read_stimuli_csv()
+
+
+def load_stimuli():
+    """Get stimuli for expt, keyed by item_id.
+
+    Stimuli are read from the compiled json artifact (or the csv, if the
+    artifact wasn't compiled from the current csv), kept in memory, and
+    only re-read when either file changes.
+
+    Returns:
+        stimuli (dict): item_id -> item data (see parse_item)
+    """
+    global _stimuli
+
+    mtimes = (_mtime(STIMULI_CSV_PATH), _mtime(STIMULI_PATH))
+    if _stimuli[0] != mtimes:
+        with _stimuli_lock:
+            if _stimuli[0] != mtimes:
+                _stimuli = (mtimes, _read_stimuli())
+
+    return _stimuli[1]
+
+
+def warm_up():
+    """Preload what request handlers need (called by the ready view).
+
+    Returns:
+        n (int): Number of stimuli loaded
+    """
+    if SCREEN_DUPLICATES:
+        screening.refresh()
+    return len(load_stimuli())
+
+
+def load_item(item_id):
+    """Load data for a specific item.
+
+    Args:
+        item_id (str): Item id for item
+
+    Returns:
+        item_data (dict): passage, critical, & attn check q's
+
+    Raises:
+        ValueError: Description
+    """
+    stimuli = load_stimuli()
+
+    if item_id not in stimuli:
+        raise ValueError(f"item_id: '{item_id}' is invalid")
+        # TODO: Generate random id if id doesn't match
+        # Log error etc
+
+    return dict(stimuli[item_id])
 
 
 """
@@ -125,7 +247,7 @@ def get_ip_address(request):
     return ip_address
 
 
-def init_ppt(request):
+def init_ppt(request, item_id=""):
     """Create new ppt."""
     get_args = str(request.GET)
     get_args += str(request.POST)
@@ -134,29 +256,120 @@ def init_ppt(request):
 
     study = request.GET.get("study", "")
 
-    # Create key
-    key = generate_key()
+    # MTurk args
+    worker_id = request.GET.get("workerId", "").strip()
+    assignment_id = request.GET.get("assignmentId", "")
 
-    # Create DB object
-    ppt = Participant.objects.create(
-        ip_address=ip_address, key=key,
-        get_args=get_args, study=study)
+    repeat_ip = SCREEN_DUPLICATES and screening.seen_ip(ip_address)
+
+    # Create DB object, with a new key if it collides
+    for attempt in range(KEY_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                ppt = Participant.objects.create(
+                    ip_address=ip_address, key=generate_key(),
+                    worker_id=worker_id, assignment_id=assignment_id,
+                    get_args=get_args, study=study, item_id=item_id)
+            break
+        except IntegrityError:
+            if attempt == KEY_ATTEMPTS - 1:
+                raise
+
+    screening.add(worker_id, ip_address)
+
+    # Flag repeat ips
+    if repeat_ip:
+        ParticipantEvent.objects.create(
+            participant=ppt, kind="repeat_ip", data=json.dumps(ip_address))
 
     return ppt
 
 
+"""
+Item assignment
+---------------
+"""
+
+# (study, stimuli version) pairs whose counters exist
+_counted_studies = set()
+
+
+def ensure_counters(study):
+    """Create any missing item counters for study."""
+    stimuli = load_stimuli()
+    version = (study, _stimuli[0])
+    if version not in _counted_studies:
+        ItemCounter.objects.bulk_create(
+            [ItemCounter(study=study, item_id=item_id) for item_id in stimuli],
+            ignore_conflicts=True)
+        _counted_studies.add(version)
+
+    return stimuli
+
+
+def assign_item(study):
+    """Assign the least-assigned item in study, and count the assignment.
+
+    The chosen counter row is locked until it's incremented; rows locked by
+    concurrent assignments are skipped, so they get the next least-assigned
+    items rather than waiting.
+
+    Returns:
+        item_id (str): Assigned item
+    """
+    stimuli = ensure_counters(study)
+    counters = ItemCounter.objects.filter(
+        study=study, item_id__in=list(stimuli)).order_by("assigned", "id")
+
+    with transaction.atomic():
+        counter = counters.select_for_update(skip_locked=True).first()
+        if counter is None:
+            # Every counter is locked: wait for the least-assigned
+            counter = counters.select_for_update().first()
+
+        ItemCounter.objects.filter(pk=counter.pk).update(
+            assigned=F("assigned") + 1)
+
+    return counter.item_id
+
+
+def count_item(study, item_id):
+    """Count an assignment of item_id made outside assign_item."""
+    ensure_counters(study)
+    ItemCounter.objects.filter(study=study, item_id=item_id).update(
+        assigned=F("assigned") + 1)
+
+
 def expt(request):
     """Return experiment view.
 
     GET Args:
-        {item_id}: id of item
+        {item_id}: id of item (if omitted, the least-assigned item in the
+            study is assigned)
+        {study}: study name
+        {workerId}: MTurk worker (rejected if they've finished before, or
+            started a different assignment)
+        {assignmentId}: MTurk assignment
     """
-    # Create ppt
-    ppt = init_ppt(request)
+    study = request.GET.get("study", "")
+
+    # Screen out repeat workers before assigning them an item
+    worker_id = request.GET.get("workerId", "").strip()
+    assignment_id = request.GET.get("assignmentId", "")
+    if SCREEN_DUPLICATES and screening.seen_worker(worker_id, assignment_id):
+        return render(request, MODULE_URL + '/duplicate.html', status=403)
 
     # Get experimental items
     item_id = request.GET.get("item_id")
-    item_data = load_item(item_id)
+    if item_id:
+        item_data = load_item(item_id)
+        count_item(study, item_id)
+    else:
+        item_id = assign_item(study)
+        item_data = load_item(item_id)
+
+    # Create ppt
+    ppt = init_ppt(request, item_id)
 
     # Create view context
     conf = {"ppt_id": ppt.id, "key": ppt.key}
@@ -171,49 +384,80 @@ def error(request):
     return render(request, MODULE_URL + '/error.html')
 
 
+def ready(request):
+    """Readiness check: warm up the worker and report what's loaded."""
+    try:
+        n_stimuli = warm_up()
+    except OSError as e:
+        return JsonResponse({"ready": False, "error": str(e)}, status=503)
+
+    return JsonResponse({"ready": True, "stimuli": n_stimuli})
+
+
 def ua_data(request):
     """Store ppt ua_data.
 
-    We do this asynchronously so we can get the fullscreen size
+    We do this asynchronously so we can get the fullscreen size. The post is
+    logged as an event, and only the ppt columns it sets are updated.
     """
     post = json.loads(request.body.decode('utf-8'))
 
     ppt_id = post['ppt_id']
 
-    ppt = Participant.objects.get(pk=ppt_id)
-    ppt.notes = ppt.notes + str(post)
-    ppt.ua_header = post.get('ua_header', "")
-    ppt.screen_width = post.get('width', "")
-    ppt.screen_height = post.get('height', "")
-    ppt.worker_id = post.get('worker_id', "")
-    ppt.assignment_id = post.get('assignment_id', "")
-    ppt.save()
+    fields = {
+        "ua_header": post.get('ua_header', ""),
+        "screen_width": post.get('width', ""),
+        "screen_height": post.get('height', ""),
+    }
+    for name in ["worker_id", "assignment_id"]:
+        if post.get(name):
+            fields[name] = post[name]
+
+    with transaction.atomic():
+        if not Participant.objects.filter(pk=ppt_id).update(
+                updated=tz.now(), **fields):
+            raise Participant.DoesNotExist(f"No ppt {ppt_id}")
+        ParticipantEvent.objects.create(
+            participant_id=ppt_id, kind="ua_data", data=json.dumps(post))
 
     return JsonResponse({"success": True})
 
 
 def validate_captcha(request):
-    """Validate captcha token."""
+    """Queue verification of a captcha token.
+
+    The score is stored on the ppt by the run_jobs worker; poll
+    captcha_status for it. If polling times out, post {"sync": true} to
+    verify the queued token now (a final attempt) and get the score.
+    """
     post = json.loads(request.body.decode('utf-8'))
 
     ppt_id = post['ppt_id']
+
+    if post.get('sync'):
+        for job in jobs.claim_for(ppt_id, "captcha"):
+            jobs.run(job, max_attempts=job.attempts + 1)
+
+        score = Participant.objects.filter(pk=ppt_id).values_list(
+            'captcha_score', flat=True).first()
+
+        return JsonResponse({"score": score})
+
     token = post.get('token')
 
-    data = {"response": token,
-            "secret": settings.CAPTCHA_SECRET_KEY}
+    jobs.enqueue("captcha", ppt_id, token=token)
 
-    response = requests.post(RECAPTCHA_URL, data=data)
+    return JsonResponse({"queued": True})
 
-    content = response.content
 
-    response_data = json.loads(content)
+def captcha_status(request):
+    """Get ppt's captcha score (null until it's been verified)."""
+    ppt_id = request.GET.get('ppt_id')
 
-    score = response_data.get('score')
-    ppt = Participant.objects.get(pk=ppt_id)
-    ppt.captcha_score = score
-    ppt.save()
+    score = Participant.objects.filter(pk=ppt_id).values_list(
+        'captcha_score', flat=True).first()
 
-    return JsonResponse(response_data)
+    return JsonResponse({"score": score})
 
 
 """
@@ -222,33 +466,40 @@ Store Data
 """
 
 
-def save_json_results(data):
-    """Save raw json results as a backup in case something goes wrong..."""
-    # Generate filename
-    timestamp = tz.now().strftime("%Y-%m-%d-%H-%M-%S")
-    ppt_id = data.get('ppt_id')
-    filename = f"{timestamp}-{ppt_id}.json"
-    filepath = os.path.join(RESULTS_DIR, filename)
+_results_log = None
 
-    # Ensure RESULTS_DIR exists
-    if not os.path.isdir(RESULTS_DIR):
-        os.mkdir(RESULTS_DIR)
 
-    # Write file
-    with open(filepath, 'w') as file:
-        json.dump(data, file, indent=4)
+def get_results_log():
+    """Results log for this worker."""
+    global _results_log
+    if _results_log is None:
+        _results_log = ResultsLog(RESULTS_DIR)
+    return _results_log
+
+
+def save_json_results(data):
+    """Save raw json results as a backup in case something goes wrong...
+
+    Submissions are appended to the compressed results log (see
+    results_log.py); replay_results rebuilds the db from it.
+    """
+    get_results_log().append({"timestamp": tz.now().isoformat(), "post": data})
 
     return True
 
 
-def store_nlm_fb_results(data, ppt):
-    """Store results from nlmfb trials."""
+def build_trials(data, ppt):
+    """Build (unsaved) critical and attention check trials for ppt.
+
+    Returns:
+        critical_trials, attn_check_trials (list, list)
+    """
     passage = [item for item in data
                if item.get('trial_part') == "passage"][0]
     critical = [item for item in data
                 if item.get("item_type") == "critical"][0]
 
-    CriticalTrial.objects.create(
+    critical_trials = [CriticalTrial(
         # Scale & ppt
         participant=ppt,
 
@@ -272,112 +523,81 @@ def store_nlm_fb_results(data, ppt):
         is_start=critical.get('is_start'),
         is_end=critical.get('is_end'),
         passage_reading_time=passage.get("rt")
-    )
+    )]
 
     attn_checks = [item for item in data
                    if item.get("item_type") == "attention_check"]
 
-    for attn_check in attn_checks:
+    attn_check_trials = [AttentionCheckTrial(
+        # Scale & ppt
+        participant=ppt,
+
+        # Item identifier
+        item_id=attn_check.get('item_id'),  # uid
+        question_id=attn_check.get('question_id'),  # question type
+        item=attn_check.get('item'),  # story id
+        item_type=attn_check.get('item_type'),  # critical/practice
+        trial_index=attn_check.get('trial_index'),
 
-        AttentionCheckTrial.objects.create(
-            # Scale & ppt
-            participant=ppt,
+        # Response info
+        response=attn_check.get('response'),
+        reaction_time=attn_check.get('rt'),
+        correct_answer=attn_check.get('correct_answer'),
+        is_correct=attn_check.get('is_correct')
+    ) for attn_check in attn_checks]
+
+    return critical_trials, attn_check_trials
 
-            # Item identifier
-            item_id=attn_check.get('item_id'),  # uid
-            question_id=attn_check.get('question_id'),  # question type
-            item=attn_check.get('item'),  # story id
-            item_type=attn_check.get('item_type'),  # critical/practice
-            trial_index=attn_check.get('trial_index'),
 
-            # Response info
-            response=attn_check.get('response'),
-            reaction_time=attn_check.get('rt'),
-            correct_answer=attn_check.get('correct_answer'),
-            is_correct=attn_check.get('is_correct')
-        )
+def store_nlm_fb_results(data, ppt):
+    """Store results from nlmfb trials (one bulk insert per trial type)."""
+    critical_trials, attn_check_trials = build_trials(data, ppt)
+    CriticalTrial.objects.bulk_create(critical_trials)
+    AttentionCheckTrial.objects.bulk_create(attn_check_trials)
 
 
-def store_demographics(data, ppt):
-    """Store demographics information."""
+def demographics_fields(data):
+    """Participant fields from demographics responses."""
     demo = [item for item in data if item.get('trial_part') == "demographics"]
 
     demo = demo[0]
     demo_data = json.loads(demo.get('responses', "{}"))
-    ppt.birth_year = demo_data.get('demographics_year') or None
-    ppt.gender = demo_data.get('demographics_gender')
-    ppt.native_english = demo_data.get('demographics_english') == "yes"
-    ppt.dyslexia = demo_data.get('dyslexia') == "true"
-    ppt.adhd = demo_data.get('adhd') == "true"
-    ppt.asd = demo_data.get('asd') == "true"
-    ppt.vision = demo_data.get('demographics_vision', "")
-    ppt.vision_reason = demo_data.get('demographics_vision_reason', "")
+    return {
+        "birth_year": demo_data.get('demographics_year') or None,
+        "gender": demo_data.get('demographics_gender'),
+        "native_english": demo_data.get('demographics_english') == "yes",
+        "dyslexia": demo_data.get('dyslexia') == "true",
+        "adhd": demo_data.get('adhd') == "true",
+        "asd": demo_data.get('asd') == "true",
+        "vision": demo_data.get('demographics_vision', ""),
+        "vision_reason": demo_data.get('demographics_vision_reason', ""),
+    }
 
-    ppt.save()
 
+def debrief_fields(data):
+    """Participant fields from debrief responses.
 
-def store_debrief(data, ppt):
-    """Store debrief information."""
-    debrief = filter(lambda x: x.get('trial_part') == "post_test", data)
+    Responses not named after a Participant field are ignored.
+    """
+    field_names = {field.attname for field in Participant._meta.concrete_fields
+                   if not field.primary_key}
 
+    fields = {}
+    debrief = filter(lambda x: x.get('trial_part') == "post_test", data)
     for debrief_item in debrief:
         debrief_data = json.loads(debrief_item.get('responses', "{}"))
         for name, response in debrief_data.items():
-            setattr(ppt, name, response)
-
-    ppt.save()
-
-
-def update_mturk(ppt):
-    """Grant qualification to worker to prevent future HITs."""
-    client = boto3.client(
-        'mturk',
-        region_name="us-east-1",
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    )
-
-    # try:
-    #     # Approve assignment
-    #     approve_response = client.approve_assignment(
-    #         AssignmentId=ppt.assignment_id,
-    #         RequesterFeedback='Thanks again for your help',
-    #         OverrideRejection=False
-    #     )
-
-    #     approve_status = approve_response["ResponseMetadata"]["HTTPStatusCode"]
-
-    #     ppt.notes = ppt.notes + str(approve_response) + "\n"
-
-    # except Exception as e:
-    #     approve_status = "Error"
-    #     ppt.notes = ppt.notes + str(e) + "\n"
-
-    try:
-        # Block future HITs
-        block_response = client.associate_qualification_with_worker(
-            QualificationTypeId='3GNL8ZDCG6N1PUOYDZQY9HUQXUMIOJ',
-            WorkerId=ppt.worker_id,
-            IntegerValue=1,
-            SendNotification=False
-        )
+            if name in field_names:
+                fields[name] = response
 
-        block_status = block_response["ResponseMetadata"]["HTTPStatusCode"]
-        ppt.notes = ppt.notes + str(block_response) + "\n"
-
-    except Exception as e:
-        block_status = "Error"
-        ppt.notes = ppt.notes + str(e) + "\n"
-
-    ppt.save()
-
-    success = True if block_status == 200 else False
-
-    return success
+    return fields
 
 
 def save_results(request):
-    """Save results to db."""
+    """Save results to db.
+
+    Trials are bulk inserted and the ppt updated once, in one transaction.
+    """
     # Get posted data
     post = json.loads(request.body.decode('utf-8'))
 
@@ -390,20 +610,22 @@ def save_results(request):
 
     # store results
     data = post['results']
-    store_nlm_fb_results(data, ppt)
-    store_demographics(data, ppt)
-    store_debrief(data, ppt)
+    fields = demographics_fields(data)
+    fields.update(debrief_fields(data))
+    fields["end_time"] = fields["updated"] = tz.now()
+
+    with transaction.atomic():
+        store_nlm_fb_results(data, ppt)
+        Participant.objects.filter(pk=ppt.pk).update(**fields)
 
-    ppt.end_time = tz.now()
-    ppt.save()
+    for name, value in fields.items():
+        setattr(ppt, name, value)
 
-    # Ppt is mturk worker
+    # Ppt is mturk worker: block future HITs
     if ppt.worker_id or ppt.assignment_id:
-        success = update_mturk(ppt)
-    else:
-        success = True
+        jobs.enqueue("mturk_qualification", ppt.pk)
 
-    status = {"success": success}
+    status = {"success": True}
 
     # Notify User
     return JsonResponse(status)
@@ -420,33 +642,266 @@ def is_admin(user):
     return user.is_superuser
 
 
-def get_model_data(model_name):
-    """Get data on all trials."""
-    model = MODELS[model_name]
+class Echo:
+    """Pseudo-buffer: write() returns what was written, for streaming."""
+
+    def write(self, value):
+        return value
+
+
+class ZipStream:
+    """Write-only buffer for zipfile that hands back what was written."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
 
-    data_list = []
-    for record in model.objects.all():
+    def flush(self):
+        pass
 
-        data = record.__dict__
-        data.pop('_state')
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
 
-        data_list.append(data)
 
-    df = pd.DataFrame(data_list)
-    df = df.sort_values('id').reset_index(drop=True)
-    return df
+def model_columns(model):
+    """Exported columns of model (its concrete fields, as stored)."""
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def parse_time(value):
+    """Parse a start/end filter: an ISO date or datetime (UTC if naive)."""
+    time = parse_datetime(value)
+    if time is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f"Invalid date: '{value}'")
+        time = datetime.datetime.combine(date, datetime.time())
+    if tz.is_naive(time):
+        time = tz.make_aware(time, datetime.timezone.utc)
+    return time
+
+
+def export_filters(params, model_name):
+    """Filter kwargs for an export, from its GET params.
+
+    since_id: Only rows with a greater id (trials and events)
+    updated_since: Only ppts updated at or after this time (ppts)
+    start, end: Only ppts who started in [start, end)
+    study: Only ppts in this study
+
+    Trials are filtered on their ppt. Trial and event rows are never
+    changed once inserted, so since_id picks up everything new; ppts are
+    updated as they progress (end_time, demographics, captcha_score...),
+    so they're followed by updated time instead.
+    """
+    prefix = "" if model_name == "participant" else "participant__"
+    filters = {}
+
+    if params.get("since_id"):
+        if model_name == "participant":
+            raise ValueError("Use updated_since for participant exports")
+        filters["id__gt"] = int(params["since_id"])
+    if params.get("updated_since"):
+        if model_name != "participant":
+            raise ValueError("updated_since only applies to participant exports")
+        filters["updated__gte"] = parse_time(params["updated_since"])
+    if params.get("start"):
+        filters[prefix + "start_time__gte"] = parse_time(params["start"])
+    if params.get("end"):
+        filters[prefix + "start_time__lt"] = parse_time(params["end"])
+    if params.get("study"):
+        filters[prefix + "study"] = params["study"]
+
+    return filters
+
+
+def export_state(request, model):
+    """Filtered querysets of an export, and the state of their rows.
+
+    Computed once per request (for the ETag, Last-Modified and the
+    response itself).
+
+    Returns:
+        state (dict): querysets ({model_name: qs}), count, last_id,
+            last_modified (ppts' latest update) and etag. None if the
+            model or filters are invalid.
+    """
+    if hasattr(request, "_export_state"):
+        return request._export_state
+
+    names = list(MODELS) if model == "all" else [model]
+    state = querysets = None
+    # Cursors are per-model, so "all" takes neither (export_filters raises)
+    if model in MODELS or model == "all":
+        try:
+            querysets = {name: MODELS[name].objects.filter(
+                **export_filters(request.GET, name)) for name in names}
+        except ValueError:
+            pass
+
+    if querysets is not None:
+        stats = []
+        for name, qs in querysets.items():
+            updated = "updated" if name == "participant" else "participant__updated"
+            stats.append(qs.aggregate(
+                count=Count("id"), last_id=Max("id"), last_modified=Max(updated)))
+
+        modified = [stat["last_modified"] for stat in stats if stat["last_modified"]]
+        state = {
+            "querysets": querysets,
+            "count": sum(stat["count"] for stat in stats),
+            "last_id": stats[0]["last_id"] if len(stats) == 1 else None,
+            "last_modified": max(modified) if modified else None,
+        }
+        state["etag"] = '"{}"'.format("-".join(
+            f'{stat["count"]}.{stat["last_id"] or 0}' for stat in stats)
+            + (f'-{state["last_modified"].timestamp():.6f}' if modified else ""))
+
+    request._export_state = state
+    return state
+
+
+def export_etag(request, model):
+    state = export_state(request, model)
+    return state and state["etag"]
+
+
+def export_last_modified(request, model):
+    state = export_state(request, model)
+    return state and state["last_modified"]
+
+
+def iter_csv(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Stream a queryset's rows as csv lines, in id order.
+
+    Rows are fetched chunk_size at a time with a server-side cursor (where
+    the db supports it), so memory use doesn't grow with the table.
+    """
+    columns = model_columns(queryset.model)
+    writer = csv.writer(Echo())
+
+    yield writer.writerow(columns)
+    rows = queryset.order_by("id").values_list(*columns)
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield writer.writerow(row)
+
+
+def iter_zip(files, buffer_size=EXPORT_BUFFER_SIZE):
+    """Stream a zip archive of files ({name: iterable of csv lines})."""
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, lines in files.items():
+            with archive.open(name, "w") as entry:
+                for line in lines:
+                    entry.write(line.encode("utf-8"))
+                    if sum(map(len, stream.chunks)) >= buffer_size:
+                        yield stream.drain()
+            yield stream.drain()
+
+    yield stream.drain()
+
+
+def export_name(model, ext):
+    """Timestamped download filename."""
+    return f'{MODULE_URL}_{model}_{tz.now():%Y-%m-%d-%H-%M-%S}.{ext}'
 
 
 @user_passes_test(is_admin)
+@condition(etag_func=export_etag, last_modified_func=export_last_modified)
 def download_data(request, model):
-    """Download csv of model data."""
-    data = get_model_data(model)
+    """Stream a csv of model data, or a zip of every model's for "all".
+
+    Takes since_id, updated_since, start, end and study filters (see
+    export_filters). Unchanged exports are answered 304 Not Modified. The
+    X-Last-Id header (trials, events) gives the since_id, and X-Last-Updated
+    (ppts) the updated_since, to pass to fetch only new or changed rows.
+    """
+    if model != "all" and model not in MODELS:
+        raise Http404(f"Unknown model: '{model}'")
 
-    fname = f'{MODULE_URL}_{model}_{tz.now():%Y-%m-%d-%H-%M-%S}.csv'
+    state = export_state(request, model)
+    if state is None:
+        return HttpResponseBadRequest("Invalid export filters")
 
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="{fname}"'
+    if model == "all":
+        fname = export_name(model, "zip")
+        files = {f"{MODULE_URL}_{name}.csv": iter_csv(qs)
+                 for name, qs in state["querysets"].items()}
+        response = StreamingHttpResponse(iter_zip(files),
+                                         content_type='application/zip')
+
+    else:
+        fname = export_name(model, "csv")
+        response = StreamingHttpResponse(iter_csv(state["querysets"][model]),
+                                         content_type='text/csv')
+        if model == "participant":
+            if state["last_modified"] is not None:
+                response['X-Last-Updated'] = state["last_modified"].isoformat()
+        elif state["last_id"] is not None:
+            response['X-Last-Id'] = state["last_id"]
 
-    data.to_csv(response, index=False)
+    response['Content-Disposition'] = f'attachment; filename="{fname}"'
 
     return response
+
+
+"""
+Key lookup
+----------
+"""
+
+
+def lookup_keys(keys):
+    """Ppts (and whether they completed) by key.
+
+    Returns:
+        ppts (dict): {key: ppt info, or None if no ppt has key}
+    """
+    keys = {key: normalize_key(key) for key in keys}
+    normalized = list(set(keys.values()))
+
+    found = {}
+    for i in range(0, len(normalized), KEY_LOOKUP_BATCH):
+        rows = Participant.objects.filter(
+            key__in=normalized[i:i + KEY_LOOKUP_BATCH]).values(
+            "key", "id", "study", "worker_id", "assignment_id", "start_time",
+            "end_time")
+        for row in rows:
+            row["completed"] = row["end_time"] is not None
+            found[row.pop("key")] = row
+
+    return {key: found.get(normalized_key) for key, normalized_key in keys.items()}
+
+
+@csrf_exempt  # Read-only
+@user_passes_test(is_admin)
+def key_lookup(request):
+    """Look up ppts by key, to verify credit.
+
+    GET Args:
+        {key}: key to look up (may be repeated)
+
+    POST (JSON):
+        {"keys": [key, ...]}: keys to look up in bulk
+
+    Returns:
+        {"ppts": {key: {id, study, worker_id, assignment_id, start_time,
+            end_time, completed} or null}}
+    """
+    if request.method == "POST":
+        try:
+            keys = json.loads(request.body.decode('utf-8'))["keys"]
+        except (ValueError, KeyError, TypeError):
+            return HttpResponseBadRequest('Post {"keys": [...]}')
+    else:
+        keys = request.GET.getlist("key")
+
+    if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+        return HttpResponseBadRequest("Keys must be strings")
+
+    return JsonResponse({"ppts": lookup_keys(keys)})
@@ -0,0 +1,252 @@
+"""Scoring backends.
+
+A backend scores a batch of prompts and returns one OpenAI Completion-style
+choice per prompt, along with token usage ({"prompt_tokens": ...,
+"completion_tokens": ...}):
+
+    {"index": i,
+     "text": "...",
+     "logprobs": {"tokens": [...], "token_logprobs": [...],
+                  "top_logprobs": [...], "text_offset": [...]}}
+
+OpenAIBackend calls the Completions API. LocalBackend runs a causal LM
+from locally stored weights in-process on CPU, so prompts can be scored
+without a key or network access.
+"""
+
+
+import os
+import threading
+
+
+class Backend:
+    """Base class for scoring backends."""
+
+    name = "backend"
+    max_concurrency = None  # Max requests in flight (None for no limit)
+
+    def complete(self, model, prompts, max_tokens, logprobs, echo,
+                 temperature=0, **kwargs):
+        """Get (choices, usage) with one choice per prompt (see module docstring)."""
+        raise NotImplementedError
+
+    def engine_id(self, model):
+        """Name of model used in cache keys."""
+        return model
+
+    def is_retryable(self, error):
+        """Whether error is transient and worth retrying."""
+        return False
+
+
+class OpenAIBackend(Backend):
+    """Score prompts with openai.Completion.create."""
+
+    name = "openai"
+
+    def __init__(self, key_path="src/models/gpt_key", api_base=None):
+        import openai
+
+        ## Read in key
+        with open(key_path, 'r') as f:
+            lines = f.read().split("\n")
+
+        openai.organization = lines[0] # org
+        openai.api_key = lines[1] # api_key
+
+        # Point at a different (e.g. local fake) Completions endpoint
+        if api_base:
+            openai.api_base = api_base
+
+        self.openai = openai
+
+    def complete(self, model, prompts, max_tokens, logprobs, echo,
+                 temperature=0, **kwargs):
+        output = self.openai.Completion.create(
+            engine = model,
+            prompt = prompts,
+            max_tokens = max_tokens,
+            temperature = temperature,
+            n = 1,
+            logprobs = logprobs,
+            echo = echo,
+            **kwargs
+            )
+
+        # Return the choices in prompt order
+        output = output.to_dict_recursive()
+        choices = sorted(output['choices'], key=lambda choice: choice['index'])
+        return choices, output.get('usage', {})
+
+    def is_retryable(self, error):
+        """Rate limits, 5xx and connection errors are transient."""
+        # Timeout only exists in later openai versions
+        names = ["APIConnectionError", "TryAgain", "RateLimitError",
+                 "ServiceUnavailableError", "Timeout"]
+        error_types = tuple(getattr(self.openai.error, name) for name in names
+                            if hasattr(self.openai.error, name))
+        if isinstance(error, error_types):
+            return True
+
+        status = getattr(error, "http_status", None)
+        return status is not None and (status == 429 or status >= 500)
+
+
+class LocalBackend(Backend):
+    """Score prompts with a local Hugging Face causal LM on CPU.
+
+    model names are resolved to weights in weights_dir/{model} (or used
+    as-is if that doesn't exist). Prompts are left-padded and run
+    batch_size at a time; decoding is greedy, so temperature is ignored.
+
+    Forward passes already use every CPU thread, so requests are run one at
+    a time (max_concurrency, and complete is serialised).
+    """
+
+    name = "local"
+    max_concurrency = 1
+
+    def __init__(self, weights_dir="models", batch_size=8, threads=None):
+        import torch
+
+        self.torch = torch
+        self.weights_dir = weights_dir
+        self.batch_size = batch_size
+        self._models = {}
+        self._load_lock = threading.Lock()
+        self._run_lock = threading.Lock()
+
+        if threads:
+            torch.set_num_threads(threads)
+
+    def engine_id(self, model):
+        return "local:" + model
+
+    def _load(self, model):
+        """Load (and keep) tokenizer and weights for model (once)."""
+        if model in self._models:
+            return self._models[model]
+
+        with self._load_lock:
+            if model not in self._models:
+                from transformers import AutoModelForCausalLM, AutoTokenizer
+
+                path = os.path.join(self.weights_dir, model)
+                if not os.path.isdir(path):
+                    path = model
+
+                tokenizer = AutoTokenizer.from_pretrained(path)
+                tokenizer.padding_side = "left"
+                if tokenizer.pad_token is None:
+                    tokenizer.pad_token = tokenizer.eos_token
+
+                lm = AutoModelForCausalLM.from_pretrained(path)
+                lm.eval()
+
+                self._models[model] = (tokenizer, lm)
+
+        return self._models[model]
+
+    def _logprobs(self, lm, input_ids, attention_mask):
+        """Next-token log-probabilities at every position."""
+        # Left padding: count positions from each sequence's first token
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+        with self.torch.no_grad():
+            logits = lm(input_ids=input_ids, attention_mask=attention_mask,
+                        position_ids=position_ids).logits
+
+        return self.torch.log_softmax(logits.float(), dim=-1)
+
+    def _top(self, tokenizer, logprobs, k):
+        """{token: logprob} for the k most likely next tokens."""
+        values, ids = logprobs.topk(k)
+        return {tokenizer.decode([i]): v
+                for i, v in zip(ids.tolist(), values.tolist())}
+
+    def _complete_batch(self, model, prompts, max_tokens, logprobs, echo):
+        torch = self.torch
+        tokenizer, lm = self._load(model)
+
+        encoded = tokenizer(prompts, return_tensors="pt", padding=True)
+        input_ids = encoded["input_ids"]
+        attention_mask = encoded["attention_mask"]
+        n_prompt = input_ids.shape[1]
+
+        # Greedy decoding, max_tokens steps
+        step_logprobs = []
+        for _ in range(max_tokens):
+            lps = self._logprobs(lm, input_ids, attention_mask)[:, -1]
+            next_ids = lps.argmax(-1, keepdim=True)
+            step_logprobs.append(lps)
+
+            input_ids = torch.cat([input_ids, next_ids], dim=-1)
+            attention_mask = torch.cat(
+                [attention_mask, torch.ones_like(next_ids)], dim=-1)
+
+        if echo:
+            echo_logprobs = self._logprobs(lm, input_ids, attention_mask)
+
+        choices = []
+        usage = {"prompt_tokens": int(encoded["attention_mask"].sum()),
+                 "completion_tokens": max_tokens * len(prompts)}
+        for i, prompt in enumerate(prompts):
+            start = n_prompt - int(encoded["attention_mask"][i].sum())
+            ids = input_ids[i].tolist()
+
+            out = {"tokens": [], "token_logprobs": [], "top_logprobs": [],
+                   "text_offset": []}
+
+            # Echoed prompt tokens (the first has no logprob)
+            if echo:
+                for pos in range(start, n_prompt):
+                    out["tokens"].append(tokenizer.decode([ids[pos]]))
+                    if pos == start:
+                        out["token_logprobs"].append(None)
+                        out["top_logprobs"].append(None)
+                        continue
+
+                    lps = echo_logprobs[i, pos - 1]
+                    out["token_logprobs"].append(lps[ids[pos]].item())
+                    out["top_logprobs"].append(
+                        self._top(tokenizer, lps, logprobs) if logprobs else None)
+
+            # Generated tokens
+            for step, lps in enumerate(step_logprobs):
+                token_id = ids[n_prompt + step]
+                out["tokens"].append(tokenizer.decode([token_id]))
+                out["token_logprobs"].append(lps[i, token_id].item())
+                out["top_logprobs"].append(
+                    self._top(tokenizer, lps[i], logprobs) if logprobs else None)
+
+            # Character offsets of each token in the returned text
+            offset = 0 if echo else len(prompt)
+            for token in out["tokens"]:
+                out["text_offset"].append(offset)
+                offset += len(token)
+
+            generated = "".join(out["tokens"][-max_tokens:]) if max_tokens else ""
+            choices.append({
+                "index": i,
+                "text": (prompt if echo else "") + generated,
+                "logprobs": out,
+                "finish_reason": "length"})
+
+        return choices, usage
+
+    def complete(self, model, prompts, max_tokens, logprobs, echo,
+                 temperature=0, **kwargs):
+        choices = []
+        usage = {"prompt_tokens": 0, "completion_tokens": 0}
+        for batch_start in range(0, len(prompts), self.batch_size):
+            batch = prompts[batch_start:batch_start + self.batch_size]
+            with self._run_lock:
+                batch_choices, batch_usage = self._complete_batch(
+                    model, batch, max_tokens, logprobs, echo)
+
+            for choice in batch_choices:
+                choice["index"] += batch_start
+                choices.append(choice)
+            for field in usage:
+                usage[field] += batch_usage[field]
+
+        return choices, usage
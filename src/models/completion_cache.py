@@ -0,0 +1,136 @@
+"""On-disk cache for Completion responses.
+
+Responses are stored one choice per prompt in a SQLite file, keyed by a hash
+of the request parameters that determine them, and evicted least recently
+used first once the cache grows past max_bytes.
+"""
+
+
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class CompletionCache:
+    """Content-addressed, size-bounded store of Completion choices."""
+
+    def __init__(self, path, max_bytes=512 * 2**20):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access"
+            " ON responses (last_access)")
+        self._conn.commit()
+
+        self.total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(engine, prompt, max_tokens, logprobs, echo, temperature):
+        """Hash the parameters that determine a response."""
+        params = [engine, prompt, max_tokens, logprobs, echo, temperature]
+        payload = json.dumps(params, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def get(self, key):
+        """Get the cached choice for key, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?",
+                (time.time(), key))
+            self._conn.commit()
+
+        return json.loads(row[0])
+
+    def put(self, key, choice):
+        """Store choice under key, evicting old entries if over budget."""
+        response = json.dumps(choice)
+        with self._lock:
+            self._insert(key, response, replace=True)
+            self._conn.commit()
+            self._evict()
+
+    def _insert(self, key, response, replace):
+        """Insert a row and keep total_bytes in step."""
+        old = self._conn.execute(
+            "SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if old is not None and not replace:
+            return False
+
+        size = len(response)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+            (key, response, size, time.time()))
+        self.total_bytes += size - (old[0] if old else 0)
+        return True
+
+    def _evict(self):
+        """Drop least recently used entries until under max_bytes."""
+        while self.total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses"
+                " ORDER BY last_access LIMIT 100").fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+
+            for key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= size
+
+        self._conn.commit()
+
+    def export_bundle(self, path):
+        """Write every entry to a gzipped JSONL bundle. Returns #entries."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, response FROM responses").fetchall()
+
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            for key, response in rows:
+                f.write(json.dumps({"key": key, "response": response}) + "\n")
+
+        return len(rows)
+
+    def import_bundle(self, path):
+        """Add entries from a bundle, keeping existing ones. Returns #added."""
+        added = 0
+        with gzip.open(path, "rt", encoding="utf-8") as f, self._lock:
+            for line in f:
+                entry = json.loads(line)
+                added += self._insert(
+                    entry["key"], entry["response"], replace=False)
+
+            self._conn.commit()
+            self._evict()
+
+        return added
+
+    def close(self):
+        """Close the underlying database."""
+        self._conn.close()
@@ -0,0 +1,74 @@
+"""Append-only JSONL journal of scoring results.
+
+Results are appended as each job completes and flushed to disk in batches,
+so a crashed run can be resumed from the passages already in the journal.
+"""
+
+
+import json
+import os
+
+
+class ResultJournal:
+    """Per-run journal of result dicts, one JSON object per line."""
+
+    def __init__(self, path, flush_every=50, resume=False):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.flush_every = flush_every
+        self._buffer = []
+
+        # Start a fresh journal unless resuming
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+
+        # Terminate a partial last line left by a crash mid-write
+        if resume and self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def records(self):
+        """Read back every complete record in the journal."""
+        self.flush()
+
+        records = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Partial last line from a crash mid-write
+                    continue
+
+        return records
+
+    def done(self, *fields):
+        """Set of field tuples (e.g. (model, item_id)) already journaled."""
+        return {tuple(record.get(field) for field in fields)
+                for record in self.records()}
+
+    def append(self, records):
+        """Add records, flushing once flush_every are buffered."""
+        self._buffer.extend(records)
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Write buffered records and sync them to disk."""
+        if not self._buffer:
+            return
+
+        self._file.write(
+            "".join(json.dumps(record) + "\n" for record in self._buffer))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer = []
+
+    def close(self):
+        """Flush and close the journal."""
+        self.flush()
+        self._file.close()
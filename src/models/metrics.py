@@ -0,0 +1,146 @@
+"""Usage, latency and cost metrics for scoring requests.
+
+Metrics are kept per engine and written out as a JSON run report and a
+Prometheus textfile (for the node_exporter textfile collector).
+"""
+
+
+import json
+import threading
+
+
+# USD per 1K tokens
+PRICE_PER_1K_TOKENS = {
+    "ada": 0.0004,
+    "babbage": 0.0005,
+    "curie": 0.002,
+    "davinci": 0.02,
+    "text-ada-001": 0.0004,
+    "text-babbage-001": 0.0005,
+    "text-curie-001": 0.002,
+    "text-davinci-002": 0.02,
+}
+
+# Latency histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf")]
+
+
+def _engine_stats():
+    return {"requests": 0, "prompts": 0, "cache_hits": 0, "retries": 0,
+            "errors": {}, "prompt_tokens": 0, "completion_tokens": 0,
+            "latency_sum": 0.0, "latency_buckets": [0] * len(LATENCY_BUCKETS)}
+
+
+class Metrics:
+    """Thread-safe per-engine request metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.engines = {}
+
+    def _stats(self, engine):
+        if engine not in self.engines:
+            self.engines[engine] = _engine_stats()
+        return self.engines[engine]
+
+    def observe(self, engine, latency, n_prompts, usage=None):
+        """Record a completed request."""
+        usage = usage or {}
+        with self._lock:
+            stats = self._stats(engine)
+            stats["requests"] += 1
+            stats["prompts"] += n_prompts
+            stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            stats["completion_tokens"] += usage.get("completion_tokens", 0)
+            stats["latency_sum"] += latency
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    stats["latency_buckets"][i] += 1
+                    break
+
+    def cache_hit(self, engine, n_prompts):
+        """Record prompts served from the cache."""
+        with self._lock:
+            self._stats(engine)["cache_hits"] += n_prompts
+
+    def error(self, engine, error):
+        """Record a failed request."""
+        with self._lock:
+            errors = self._stats(engine)["errors"]
+            name = type(error).__name__
+            errors[name] = errors.get(name, 0) + 1
+
+    def retry(self, engine):
+        """Record a retried job."""
+        with self._lock:
+            self._stats(engine)["retries"] += 1
+
+    def report(self):
+        """Metrics (with token totals and estimated cost) per engine."""
+        with self._lock:
+            report = {}
+            for engine, stats in self.engines.items():
+                stats = json.loads(json.dumps(stats))
+                total_tokens = stats["prompt_tokens"] + stats["completion_tokens"]
+                price = PRICE_PER_1K_TOKENS.get(engine)
+
+                stats["total_tokens"] = total_tokens
+                stats["cost_usd"] = (None if price is None
+                                     else round(total_tokens / 1000 * price, 6))
+                stats["latency_mean"] = (stats["latency_sum"] / stats["requests"]
+                                         if stats["requests"] else None)
+                report[engine] = stats
+
+        return report
+
+    def prometheus(self):
+        """Report in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP nlm_fb_{name} {help_text}")
+            lines.append(f"# TYPE nlm_fb_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"nlm_fb_{name}{{{label_text}}} {value}")
+
+        report = self.report()
+        for name, help_text in [("requests", "API requests made"),
+                                ("prompts", "Prompts sent to the API"),
+                                ("cache_hits", "Prompts served from the cache"),
+                                ("retries", "Jobs retried after an error"),
+                                ("prompt_tokens", "Prompt tokens used"),
+                                ("completion_tokens", "Completion tokens used")]:
+            metric(name + "_total", "counter", help_text,
+                   [({"engine": e}, s[name]) for e, s in report.items()])
+
+        metric("errors_total", "counter", "Failed API requests",
+               [({"engine": e, "type": t}, n)
+                for e, s in report.items() for t, n in s["errors"].items()])
+        metric("cost_usd", "gauge", "Estimated spend in USD",
+               [({"engine": e}, s["cost_usd"]) for e, s in report.items()
+                if s["cost_usd"] is not None])
+
+        lines.append("# HELP nlm_fb_request_latency_seconds API request latency")
+        lines.append("# TYPE nlm_fb_request_latency_seconds histogram")
+        for engine, stats in report.items():
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats["latency_buckets"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else bound
+                lines.append(f'nlm_fb_request_latency_seconds_bucket'
+                             f'{{engine="{engine}",le="{le}"}} {cumulative}')
+            lines.append(f'nlm_fb_request_latency_seconds_sum'
+                         f'{{engine="{engine}"}} {stats["latency_sum"]}')
+            lines.append(f'nlm_fb_request_latency_seconds_count'
+                         f'{{engine="{engine}"}} {stats["requests"]}')
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write path.json and path.prom run reports."""
+        with open(path + ".json", "w") as f:
+            json.dump(self.report(), f, indent=4)
+
+        with open(path + ".prom", "w") as f:
+            f.write(self.prometheus())
@@ -1,31 +1,159 @@
+"""Log-odds and token generation accuracy for every processed model.
+
+Finds each model's results (Parquet store partitions and legacy
+data/processed/{task}_gpt3-{model}_surprisals_probs.csv files), scores them
+in parallel, and saves one summary table broken down by condition,
+knowledge_cue, first_mention and recent_mention.
+"""
+
+
+import glob
+import os
+import re
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 
-df = pd.read_csv("data/processed/fb_gpt3-davinci_surprisals_probs.csv")
+import result_store
+
+
+RESULT_COLUMNS = ["item_id", "lp_pred", "pred_t1", "pred_t2", "pred_lp1", "pred_lp2"]
+STIMULUS_COLUMNS = ["condition", "knowledge_cue", "first_mention", "recent_mention",
+                    "critical_a", "start", "end"]
+FACTORS = ["condition", "knowledge_cue", "first_mention", "recent_mention"]
+
+
+def discover(task, root=result_store.ROOT):
+    """List (model, kind, path) for every model with results for task.
+
+    Models in the Parquet store take precedence over legacy per-model CSVs,
+    which take precedence over the sweep CSV, so each model is scored once.
+    """
+    sources = [(model, "parquet", root)
+               for model in result_store.list_models(task, root)]
+    found = {model for model, _, _ in sources}
+
+    pattern = os.path.join(root, "{TASK}_gpt3-*_surprisals_probs.csv".format(TASK=task))
+    sweep_path = None
+    for path in sorted(glob.glob(pattern)):
+        model = re.search("_gpt3-(.+)_surprisals_probs.csv$", path).group(1)
+        if model == "sweep":
+            sweep_path = path
+        elif model not in found:
+            sources.append((model, "csv", path))
+            found.add(model)
+
+    if sweep_path:
+        swept = pd.read_csv(sweep_path, usecols=["model"])["model"].unique()
+        sources += [(model, "sweep", sweep_path)
+                    for model in swept if model not in found]
+
+    return sources
+
+
+def load_source(task, source):
+    """Load only the columns needed for scoring from one source."""
+    model, kind, path = source
+    columns = RESULT_COLUMNS + STIMULUS_COLUMNS
+
+    if kind == "parquet":
+        return result_store.load_results(
+            task, columns=RESULT_COLUMNS, stimulus_columns=STIMULUS_COLUMNS,
+            models=[model], root=path)
+
+    if kind == "sweep":
+        df = pd.read_csv(path, usecols=["model"] + columns)
+        return df[df["model"] == model].reset_index(drop=True)
+
+    df = pd.read_csv(path, usecols=columns)
+    df.insert(0, "model", model)
+    return df
+
+
+def score(df):
+    """Add log-odds and token generation accuracy columns.
+
+    A generated answer spans both predicted tokens when together they form
+    a candidate word (e.g. cup + board), for any candidate vocabulary.
+    """
+    df["lp_accuracy"] = df["lp_pred"] == df["critical_a"]
+
+    vocab = set(df["start"]) | set(df["end"])
+    pred_t1 = df["pred_t1"].fillna("").astype(str)
+    pred_t2 = df["pred_t2"].fillna("").astype(str)
+    joined = pred_t1 + pred_t2
+    two_tokens = joined.isin(vocab) & (pred_t2 != "")
+
+    df["tg_n_tokens"] = np.where(two_tokens, 2, 1)
+    df["tg_token"] = np.where(two_tokens, joined, pred_t1)
+    df["tg_lp"] = np.where(two_tokens, df["pred_lp1"] + df["pred_lp2"], df["pred_lp1"])
+    df["tg_accuracy"] = df["tg_token"] == df["critical_a"]
+
+    return df
+
+
+def summarise(df):
+    """Accuracy per model, overall and for each level of each factor."""
+    metrics = ["lp_accuracy", "tg_accuracy"]
+
+    overall = df.groupby("model")[metrics].agg("mean")
+    overall["n"] = df.groupby("model").size()
+    overall = overall.reset_index()
+    overall["factor"] = "all"
+    overall["level"] = "all"
+
+    frames = [overall]
+    for factor in FACTORS:
+        grouped = df.groupby(["model", factor])
+        by_factor = grouped[metrics].agg("mean")
+        by_factor["n"] = grouped.size()
+        by_factor = by_factor.reset_index().rename(columns={factor: "level"})
+        by_factor["factor"] = factor
+        frames.append(by_factor)
+
+    columns = ["model", "factor", "level", "n"] + metrics
+    return pd.concat(frames, ignore_index=True)[columns]
+
+
+def evaluate(task, source):
+    """Score and summarise one source."""
+    return summarise(score(load_source(task, source)))
+
 
-df["lp_accuracy"] = df["lp_pred"] == df["critical_a"]
+def main(task, workers=None):
+    """Evaluate every processed model for task and save a summary table."""
+    sources = discover(task)
+    print("#sources: {N}".format(N = len(sources)))
 
-print(f"log odds accuracy: {round(df.lp_accuracy.mean(), 3)}")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        summaries = list(executor.map(evaluate, [task] * len(sources), sources))
 
-df[["token_c1", "token_c2", "start_logprob", "end_logprob", "log_odds", "lp_pred", "critical_a", "lp_accuracy"]]
+    df_summary = pd.concat(summaries, ignore_index=True)
+    df_summary = df_summary.sort_values(["model", "factor", "level"]).reset_index(drop=True)
 
-df["tg_n_tokens"] = df.apply(lambda x: 2 if x["pred_t1"] + x["pred_t2"] in ["cupboard", "toolbox"] else 1, axis=1)
-df["tg_token"] = df.apply(lambda x: x["pred_t1"] + x["pred_t2"] if x["tg_n_tokens"] == 2 else x["pred_t1"], axis=1)
-df["tg_lp"] = df.apply(lambda x: x["pred_lp1"] + x["pred_lp2"] if x["tg_n_tokens"] == 2 else x["pred_lp1"], axis=1)
-df["tg_accuracy"] = df["tg_token"] == df["critical_a"]
+    overall = df_summary[df_summary["factor"] == "all"]
+    for _, row in overall.iterrows():
+        print(f"{row['model']}: log odds accuracy: {round(row.lp_accuracy, 3)}, "
+              f"token gen accuracy: {round(row.tg_accuracy, 3)}")
 
-print(f"token gen accuracy: {round(df.tg_accuracy.mean(), 3)}")
+    df_summary.to_csv(
+        os.path.join(result_store.ROOT, "{TASK}_model_acc.csv".format(TASK=task)),
+        index=False)
 
-df = pd.read_csv("data/processed/fb_gpt3-text-davinci-002_surprisals_probs.csv")
+    return df_summary
 
-df["lp_accuracy"] = df["lp_pred"] == df["critical_a"]
 
-print(f"log odds accuracy: {round(df.lp_accuracy.mean(), 3)}")
+if __name__ == "__main__":
+    from argparse import ArgumentParser
 
-df[["token_c1", "token_c2", "start_logprob", "end_logprob", "log_odds", "lp_pred", "critical_a", "lp_accuracy"]]
+    parser = ArgumentParser()
 
-df["tg_n_tokens"] = df.apply(lambda x: 2 if x["pred_t1"] + x["pred_t2"] in ["cupboard", "toolbox"] else 1, axis=1)
-df["tg_token"] = df.apply(lambda x: x["pred_t1"] + x["pred_t2"] if x["tg_n_tokens"] == 2 else x["pred_t1"], axis=1)
-df["tg_lp"] = df.apply(lambda x: x["pred_lp1"] + x["pred_lp2"] if x["tg_n_tokens"] == 2 else x["pred_lp1"], axis=1)
-df["tg_accuracy"] = df["tg_token"] == df["critical_a"]
+    parser.add_argument("--path", type=str, dest="task",
+                        default="fb")
+    parser.add_argument("--workers", type=int, dest="workers",
+                        default=None)
 
-print(f"token gen accuracy: {round(df.tg_accuracy.mean(), 3)}")
\ No newline at end of file
+    args = vars(parser.parse_args())
+    main(**args)
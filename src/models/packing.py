@@ -0,0 +1,83 @@
+"""Local token counting and request packing.
+
+Prompts are tokenized locally with the GPT BPE vocabulary (via tiktoken),
+so token use and cost can be estimated before any request is sent, and
+passages can be packed into batched requests under a token budget.
+"""
+
+
+import warnings
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# BPE encoding per model (GPT-3 base and text-*-001 models use r50k_base)
+ENCODINGS = {
+    "text-davinci-002": "p50k_base",
+}
+DEFAULT_ENCODING = "r50k_base"
+
+
+def get_encoding(model):
+    """tiktoken encoding for model.
+
+    None if tiktoken isn't installed, or its BPE file can't be loaded
+    (tiktoken downloads it on first use, so e.g. when offline).
+    """
+    return _load_encoding(ENCODINGS.get(model, DEFAULT_ENCODING))
+
+
+@lru_cache(maxsize=None)
+def _load_encoding(name):
+    if tiktoken is None:
+        return None
+
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        warnings.warn(f"Couldn't load tiktoken encoding {name} ({e!r}); "
+                      "estimating token counts from characters")
+        return None
+
+
+def count_tokens(model, texts):
+    """Number of tokens in each text.
+
+    Falls back to ~4 characters per token without a tiktoken encoding.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return [len(text) // 4 + 1 for text in texts]
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+
+def pack(sizes, capacity, max_items=None):
+    """Pack items into as few bins as possible (first-fit decreasing).
+
+    Args:
+        sizes (list): Size (e.g. tokens) of each item
+        capacity (int): Max total size per bin; larger items get their own
+        max_items (int): Max items per bin (None for no limit)
+
+    Returns:
+        bins (list): Lists of item indices, each in input order
+    """
+    bins = []
+    totals = []
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True)
+    for i in order:
+        for b, total in enumerate(totals):
+            fits = total + sizes[i] <= capacity
+            if fits and (max_items is None or len(bins[b]) < max_items):
+                bins[b].append(i)
+                totals[b] += sizes[i]
+                break
+        else:
+            bins.append([i])
+            totals.append(sizes[i])
+
+    return [sorted(items) for items in sorted(bins, key=min)]
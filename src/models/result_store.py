@@ -0,0 +1,155 @@
+"""Columnar store for model results.
+
+Stimulus text is stored once per task, and each model's results are stored
+as a Parquet partition keyed by item_id:
+
+    data/processed/{task}/stimuli.parquet
+    data/processed/{task}/results/model={model}/part-0.parquet
+
+Readers load only the columns they ask for, memory-mapped, and join on
+item_id.
+"""
+
+
+import glob
+import os
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+ROOT = "data/processed"
+
+
+def task_dir(task, root=ROOT):
+    """Directory holding a task's store."""
+    return os.path.join(root, task)
+
+
+def write_stimuli(task, df_passages, root=ROOT):
+    """Store the stims for task, one row per item_id.
+
+    df_passages is a dataframe, or an iterable of dataframe chunks (e.g.
+    generated stims), which are written one at a time.
+    """
+    os.makedirs(task_dir(task, root), exist_ok=True)
+    if isinstance(df_passages, pd.DataFrame):
+        df_passages = [df_passages]
+
+    writer = None
+    for df_chunk in df_passages:
+        table = pa.Table.from_pandas(df_chunk.reset_index(drop=True),
+                                     preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(
+                os.path.join(task_dir(task, root), "stimuli.parquet"), table.schema)
+        writer.write_table(table.cast(writer.schema))
+
+    if writer is not None:
+        writer.close()
+
+
+def write_results(task, model, df_results, root=ROOT):
+    """Store (replace) one model's results for task.
+
+    df_results must have an item_id column; stimulus text (passage) and the
+    model column are dropped, since they're stored elsewhere.
+    """
+    df_results = df_results.drop(
+        columns=[c for c in ["passage", "model"] if c in df_results])
+
+    partition = os.path.join(task_dir(task, root), "results", f"model={model}")
+    os.makedirs(partition, exist_ok=True)
+    table = pa.Table.from_pandas(df_results.reset_index(drop=True),
+                                 preserve_index=False)
+    pq.write_table(table, os.path.join(partition, "part-0.parquet"))
+
+
+def list_models(task, root=ROOT):
+    """Models with results stored for task."""
+    partitions = glob.glob(os.path.join(task_dir(task, root), "results", "model=*"))
+    return sorted(os.path.basename(p)[len("model="):] for p in partitions)
+
+
+def load_stimuli(task, columns=None, root=ROOT):
+    """Load stims for task (only the given columns, plus item_id)."""
+    if columns is not None:
+        columns = ["item_id"] + [c for c in columns if c != "item_id"]
+
+    path = os.path.join(task_dir(task, root), "stimuli.parquet")
+    return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+
+
+def load_results(task, columns=None, stimulus_columns=None, models=None,
+                 root=ROOT):
+    """Load results for task as a long-format dataframe.
+
+    Args:
+        task (str): Stims name, e.g. "fb"
+        columns (list): Result columns to load (None for all)
+        stimulus_columns (list): Stimulus columns to join on item_id
+        models (list): Models to load (None for all)
+
+    Returns:
+        df (pd.DataFrame): One row per (model, item_id)
+    """
+    if columns is not None:
+        columns = ["item_id"] + [c for c in columns if c != "item_id"]
+
+    models = models or list_models(task, root)
+
+    frames = []
+    for model in models:
+        path = os.path.join(task_dir(task, root), "results", f"model={model}")
+        df = pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+        df.insert(0, "model", model)
+        frames.append(df)
+
+    df = pd.concat(frames, ignore_index=True)
+
+    if stimulus_columns:
+        df_stimuli = load_stimuli(task, stimulus_columns, root)
+        df = pd.merge(df, df_stimuli, on="item_id")
+
+    return df
+
+
+def import_csv(task, path, root=ROOT):
+    """Add a legacy {task}_gpt3-{model}_surprisals_probs.csv to the store."""
+    match = re.search(f"{task}_gpt3-(.+)_surprisals_probs.csv$", path)
+    model = match.group(1)
+
+    df = pd.read_csv(path, index_col=0)
+    stim_path = "data/stims/{FILE}.csv".format(FILE=task)
+    stimulus_columns = [c for c in pd.read_csv(stim_path, nrows=0).columns
+                        if c != "item_id"]
+
+    write_results(task, model, df.drop(columns=stimulus_columns, errors="ignore"),
+                  root)
+
+    return model
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+
+    parser.add_argument("--path", type=str, dest="task",
+                        default="fb")
+
+    args = parser.parse_args()
+
+    # Convert existing per-model CSVs
+    csvs = sorted(glob.glob(os.path.join(
+        ROOT, "{TASK}_gpt3-*_surprisals_probs.csv".format(TASK=args.task))))
+    for csv in csvs:
+        if "gpt3-sweep" not in csv:
+            print("Imported: {M}".format(M = import_csv(args.task, csv)))
+
+    stims = pd.read_csv("data/stims/{FILE}.csv".format(FILE=args.task))
+    stims['passage'] = stims['passage'].apply(lambda x: x.replace("\n", ""))
+    stims['passage'] = stims['passage'].apply(lambda x: x.replace("[MASK]. ", "[MASK]."))
+    write_stimuli(args.task, stims)
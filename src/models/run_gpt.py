@@ -1,71 +1,161 @@
 """Code for GPT-3"""
 
 
-import openai
+import json
+import os
+import re
 import time
+
 import numpy as np
 import pandas as pd
 
+from itertools import zip_longest
 from tqdm import tqdm
 
-## Read in key
-with open('src/models/gpt_key', 'r') as f:
-    lines = f.read().split("\n")
+import packing
+import result_store
+import stimuli
+from backends import LocalBackend, OpenAIBackend
+from completion_cache import CompletionCache
+from journal import ResultJournal
+from metrics import Metrics, PRICE_PER_1K_TOKENS
+from scheduler import Job, RateLimiter, Scheduler
+
+# Scoring backend (a backends.Backend), set up in __main__ or on first use
+backend = None
+
+# Response cache (a CompletionCache), set up in __main__
+cache = None
+
+# Request usage, latency and error metrics
+metrics = Metrics()
+
+
+def get_backend():
+    """Current scoring backend, defaulting to the OpenAI API."""
+    global backend
+    if backend is None:
+        backend = OpenAIBackend()
+    return backend
+
+
+def create_completion(model, prompts, max_tokens, logprobs, echo,
+                      temperature=0, **kwargs):
+    """Get one choice per prompt, only requesting prompts not in the cache."""
+    scorer = get_backend()
+    choices = [None] * len(prompts)
+
+    keys = []
+    if cache is not None:
+        engine = scorer.engine_id(model)
+        keys = [cache.key(engine, prompt, max_tokens, logprobs, echo, temperature)
+                for prompt in prompts]
+        choices = [cache.get(key) for key in keys]
+
+    missing = [i for i, choice in enumerate(choices) if choice is None]
+    if len(missing) < len(prompts):
+        metrics.cache_hit(model, len(prompts) - len(missing))
+
+    if missing:
+        request_start = time.monotonic()
+        try:
+            new_choices, usage = scorer.complete(
+                model, [prompts[i] for i in missing],
+                max_tokens = max_tokens,
+                logprobs = logprobs,
+                echo = echo,
+                temperature = temperature,
+                **kwargs
+                )
+        except Exception as e:
+            metrics.error(model, e)
+            raise
+
+        metrics.observe(model, time.monotonic() - request_start, len(missing), usage)
+
+        for i, choice in zip(missing, new_choices):
+            choices[i] = choice
+            if cache is not None:
+                cache.put(keys[i], choice)
+
+    return choices
+
+
+def candidate_vocab(df_passages, c1, c2):
+    """All c1/c2 words in the stims, e.g. every start/end location."""
+    return sorted(set(df_passages[c1]) | set(df_passages[c2]))
+
+
+def passage_candidates(experimental_sentence, start, end, vocab):
+    """Candidates for a sentence: start, end, then any other vocab words it
+    mentions, in order of first mention."""
+    others = []
+    for word in vocab:
+        match = re.search(r"\b{W}\b".format(W=re.escape(word)), experimental_sentence)
+        if match and word not in (start, end):
+            others.append((match.start(), word))
+
+    return [start, end] + [word for _, word in sorted(others)]
+
+
+def _target_span(logprobs, char_start, char_end):
+    """Get (word, logprob) of the tokens covering [char_start, char_end).
+
+    Uses the echoed text_offsets, so words of any token length (e.g.
+    cup + board) are aligned to their own tokens.
+    """
+    tokens = []
+    logprob = 0
+    for token, token_logprob, offset in zip(logprobs["tokens"],
+                                            logprobs["token_logprobs"],
+                                            logprobs["text_offset"]):
+        if offset < char_end and offset + len(token) > char_start:
+            tokens.append(token)
+            logprob += token_logprob
 
-org = lines[0]
-api_key = lines[1]
-openai.organization = org # org
-openai.api_key = api_key # api_key
+    return ''.join(tokens).replace(" ", ""), logprob
 
 
-def log_odds_gpt3(experimental_sentence,start, end, word_idx, model="ada"): 
-    """Get log_odds of start/end word in sentence."""
-    v_start = experimental_sentence.replace("[MASK].", start)
-    v_end = experimental_sentence.replace("[MASK].", end)
-    start_output = openai.Completion.create(
-        engine = model,
-        prompt = v_start,
-        max_tokens = 0,
-        temperature = 0,
-        n = 1,
-        stream = False,
-        logprobs = 0,
-        stop = "\n",
-        echo = True
-        )
+def score_candidates_batch(experimental_sentences, candidate_lists, model="ada"):
+    """Echo-score every candidate of every sentence, all in one request.
 
-    end_output = openai.Completion.create(
-        engine = model,
-        prompt = v_end,
+    Each candidate is substituted for [MASK]. and its tokens are found from
+    the echoed text offsets. Returns a {candidate: (target_word, logprob)}
+    dict for each sentence.
+    """
+    prompts = []
+    spans = []
+    for sentence, candidates in zip(experimental_sentences, candidate_lists):
+        char_start = sentence.index("[MASK].")
+        for candidate in candidates:
+            prompts.append(sentence.replace("[MASK].", candidate))
+            spans.append((char_start, char_start + len(candidate)))
+
+    choices = create_completion(
+        model, prompts,
         max_tokens = 0,
         temperature = 0,
-        n = 1,
         stream = False,
         logprobs = 0,
         stop = "\n",
         echo = True
         )
 
-    ### For cupboard and toolbox, take product of tool + box and cup + board.
-    if start in ['cupboard', 'toolbox']:
-        start_logprobs = start_output.to_dict()['choices'][0].to_dict()['logprobs']["token_logprobs"][word_idx-1:]
-        start_target_words = start_output.to_dict()['choices'][0].to_dict()['logprobs']["tokens"][word_idx-1:]
-
-        start_target_word = ''.join(start_target_words).replace(" ", "")
-        start_logprob = sum(start_logprobs)
-    else:
-        start_logprob = start_output.to_dict()['choices'][0].to_dict()['logprobs']["token_logprobs"][word_idx]
-        start_target_word = start_output.to_dict()['choices'][0].to_dict()['logprobs']["tokens"][word_idx].replace(" ", "")
+    targets = (_target_span(choice['logprobs'], *span)
+               for choice, span in zip(choices, spans))
+    return [{candidate: next(targets) for candidate in candidates}
+            for candidates in candidate_lists]
 
 
-    # info for start
-    end_logprob = end_output.to_dict()['choices'][0].to_dict()['logprobs']["token_logprobs"][word_idx]
-    end_target_word = end_output.to_dict()['choices'][0].to_dict()['logprobs']["tokens"][word_idx].replace(" ", "")
+def _log_odds_info(experimental_sentence, start_target, end_target):
+    """Assemble the log-odds result for one sentence."""
+    start_target_word, start_logprob = start_target
+    end_target_word, end_logprob = end_target
 
     # ratio
     log_odds = start_logprob - end_logprob
 
-    lp_pred = start_target_word if log_odds > 0 else end_target_word 
+    lp_pred = start_target_word if log_odds > 0 else end_target_word
 
     return {'log_odds': log_odds,
             'token_c1': start_target_word,
@@ -76,89 +166,468 @@ def log_odds_gpt3(experimental_sentence,start, end, word_idx, model="ada"):
             "lp_pred": lp_pred}
 
 
-def pred_tokens(prompt, n=1, model="ada"): 
+def _candidates_info(info, targets):
+    """Add every candidate's logprob, and the most likely one, to info."""
+    logprobs = {candidate: logprob for candidate, (_, logprob) in targets.items()}
+    info["candidate_logprobs"] = json.dumps(logprobs)
+    info["cand_pred"] = max(logprobs, key=logprobs.get)
+
+
+def log_odds_gpt3_batch(experimental_sentences, starts, ends, model="ada"):
+    """Get log_odds of start/end words for many sentences in one request.
+
+    The start and end variants of each sentence are packed into a single
+    list-valued prompt, and choices are mapped back to their sentence by
+    index.
+    """
+    targets = score_candidates_batch(
+        experimental_sentences, [[start, end] for start, end in zip(starts, ends)],
+        model=model)
+
+    return [_log_odds_info(sentence, sentence_targets[start], sentence_targets[end])
+            for sentence, start, end, sentence_targets
+            in zip(experimental_sentences, starts, ends, targets)]
+
+
+def log_odds_gpt3(experimental_sentence,start, end, model="ada"): 
     """Get log_odds of start/end word in sentence."""
-    prompt = prompt.replace(" [MASK].", "")
+    return log_odds_gpt3_batch(
+        [experimental_sentence], [start], [end], model=model)[0]
+
 
-    output = openai.Completion.create(
-        engine = model,
-        prompt = prompt,
+def pred_tokens_batch(prompts, n=1, model="ada", logprobs=1):
+    """Get predicted tokens and logprobs for many prompts in one request.
+
+    Returns the logprobs dict (tokens, token_logprobs, top_logprobs, ...)
+    for each prompt.
+    """
+    prompts = [prompt.replace(" [MASK].", "") for prompt in prompts]
+
+    choices = create_completion(
+        model, prompts,
         max_tokens = n,
         temperature = 0,
-        n = 1,
-        logprobs = 1,
+        logprobs = logprobs,
         echo = False
         )
 
-    tokens = output.to_dict()['choices'][0].to_dict()["logprobs"]["tokens"]
-    token_logprobs = output.to_dict()['choices'][0].to_dict()["logprobs"]["token_logprobs"]
+    return [choice["logprobs"] for choice in choices]
 
-    return (tokens, token_logprobs)
 
+def pred_tokens(prompt, n=1, model="ada"): 
+    """Get log_odds of start/end word in sentence."""
+    pred = pred_tokens_batch([prompt], n=n, model=model)[0]
+    return (pred["tokens"], pred["token_logprobs"])
+
+
+def _add_preds(info, pred):
+    """Add the model's predicted next tokens to an info dict."""
+    info["pred_t1"] = pred["tokens"][0].strip()
+    info["pred_t2"] = pred["tokens"][1].strip()
+    info["pred_lp1"] = pred["token_logprobs"][0]
+    info["pred_lp2"] = pred["token_logprobs"][1]
+
+
+def _passage_infos(df_chunk, c1, c2, model, targets, preds):
+    """Assemble info dicts for a chunk from candidate targets and preds."""
+    infos = []
+    for row, sentence_targets, pred in zip(
+            df_chunk.itertuples(index=False), targets, preds):
+        start, end = getattr(row, c1), getattr(row, c2)
+        info = _log_odds_info(row.passage, sentence_targets[start],
+                              sentence_targets[end])
+        _candidates_info(info, sentence_targets)
+        _add_preds(info, pred)
+        info["item_id"] = row.item_id
+        info["model"] = model
+        infos.append(info)
+
+    return infos
 
-def main(filename, c1, c2, model='ada'):
-    """
-    Run GPT-3 on stims. 
 
-    Requires that filename point to a .csv file with a "passage" column, as well as 
-    columns for the two words (c1 vs. c2) to be comparing (e.g., start vs. end).
+def score_passages(df_chunk, c1, c2, model="ada", vocab=()):
+    """Get log-odds and predicted tokens for a chunk of passages.
 
+    Issues one batched scoring request, covering c1, c2 and any other vocab
+    words each passage mentions, and one batched prediction request for the
+    whole chunk.
     """
+    texts = df_chunk['passage'].tolist()
+    candidate_lists = [passage_candidates(text, start, end, vocab)
+                       for text, start, end in zip(texts, df_chunk[c1], df_chunk[c2])]
 
-    # Assemble data path
-    data_path = "data/stims/{FILE}.csv".format(FILE=filename)
+    # Get logprobs for every candidate
+    targets = score_candidates_batch(texts, candidate_lists, model=model)
+
+    # Get predictions from model
+    preds = pred_tokens_batch(texts, n=2, model=model)
+
+    return _passage_infos(df_chunk, c1, c2, model, targets, preds)
 
-    # Usnig which model?
-    print("Using model: {M}".format(M = model))
-    
-    # Read in stims
-    df_passages = pd.read_csv(data_path)
-    print("#passages: {M}".format(M = len(df_passages)))
 
+def score_passages_topk(df_chunk, c1, c2, model="ada", vocab=(), top_k=5):
+    """Get log-odds and predicted tokens from one top-k request per passage.
+
+    Candidate logprobs are read from the top_k logprobs of the first
+    predicted token. Only candidates missing from the top-k (including
+    multi-token words like cupboard/toolbox) are echo-scored.
+    """
+    texts = df_chunk['passage'].tolist()
+    candidate_lists = [passage_candidates(text, start, end, vocab)
+                       for text, start, end in zip(texts, df_chunk[c1], df_chunk[c2])]
+
+    # Get predictions (and top-k logprobs) from model
+    preds = pred_tokens_batch(texts, n=2, model=model, logprobs=top_k)
+
+    targets = [{} for _ in texts]
+    fallback = [[] for _ in texts]
+    for i, pred in enumerate(preds):
+        top_logprobs = pred["top_logprobs"][0]
+        for candidate in candidate_lists[i]:
+            logprob = top_logprobs.get(" " + candidate)
+            if logprob is None:
+                fallback[i].append(candidate)
+            else:
+                targets[i][candidate] = (candidate, logprob)
+
+    # Echo-score the rest
+    if any(fallback):
+        needed = [i for i, candidates in enumerate(fallback) if candidates]
+        fallback_targets = score_candidates_batch(
+            [texts[i] for i in needed], [fallback[i] for i in needed], model=model)
+
+        for i, sentence_targets in zip(needed, fallback_targets):
+            targets[i].update(sentence_targets)
+
+    # Keep candidates in their original order
+    targets = [{candidate: sentence_targets[candidate] for candidate in candidates}
+               for candidates, sentence_targets in zip(candidate_lists, targets)]
+
+    return _passage_infos(df_chunk, c1, c2, model, targets, preds)
+
+
+def clean_passages(df_passages):
+    """Clean up passage text for scoring."""
     # Remove any line splits
     df_passages['passage'] = df_passages['passage'].apply(lambda x: x.replace("\n", ""))
     df_passages['passage'] = df_passages['passage'].apply(lambda x: x.replace("[MASK]. ", "[MASK]."))
 
-    # For each passage, get log-odds of c1 vs. c2
-    results = []
-    with tqdm(total=df_passages.shape[0]) as pbar:            
-        for index, row in df_passages.iterrows():
+    return df_passages
+
+
+def iter_passages(filename, chunk_size=1000):
+    """Stream the stims for filename as cleaned dataframes of up to chunk_size rows.
+
+    Stims are generated lazily from data/stims/{filename}_templates.json
+    if it exists (see stimuli.py), or else read from data/stims/{filename}.csv.
+    """
+    templates_path = stimuli.templates_path(filename)
+    if os.path.exists(templates_path):
+        templates = stimuli.load_templates(templates_path)
+        chunks = (pd.DataFrame(rows, columns=templates["columns"])
+                  for rows in stimuli.chunks(stimuli.generate(templates), chunk_size))
+    else:
+        chunks = pd.read_csv("data/stims/{FILE}.csv".format(FILE=filename),
+                             chunksize=chunk_size)
+
+    for df_chunk in chunks:
+        yield clean_passages(df_chunk)
+
+
+def load_passages(filename):
+    """Read and clean all the stims for filename."""
+    df_passages = pd.concat(iter_passages(filename), ignore_index=True)
+    print("#passages: {M}".format(M = len(df_passages)))
+
+    return df_passages
+
+
+def stims_vocab(filename, c1, c2, chunk_size=1000):
+    """candidate_vocab over the whole stream of stims."""
+    vocab = set()
+    for df_chunk in iter_passages(filename, chunk_size):
+        vocab.update(candidate_vocab(df_chunk, c1, c2))
+    return sorted(vocab)
+
+
+def write_csv_chunks(chunks, path):
+    """Write a stream of dataframes to one .csv, numbering rows across them."""
+    n = 0
+    with open(path, "w") as f:
+        for i, df_chunk in enumerate(chunks):
+            df_chunk.index = range(n, n + len(df_chunk))
+            df_chunk.to_csv(f, header=(i == 0))
+            n += len(df_chunk)
+
+
+def passage_tokens(df_passages, c1, c2, model, vocab):
+    """Prompt + completion tokens needed to score each passage.
+
+    Covers the echo prompts for every candidate even with top-k, where
+    candidates missing from the top-k are still echo-scored.
+    """
+    tokens = []
+    for text, start, end in zip(df_passages['passage'], df_passages[c1], df_passages[c2]):
+        # Prediction prompt, plus echo prompts
+        prompts = [text.replace(" [MASK].", "")]
+        prompts += [text.replace("[MASK].", candidate)
+                    for candidate in passage_candidates(text, start, end, vocab)]
+
+        tokens.append(sum(packing.count_tokens(model, prompts)) + 2)
+
+    return tokens
+
+
+def make_jobs(df_passages, c1, c2, model, vocab, batch_size=10, top_k=0,
+              max_batch_tokens=None):
+    """Split passages into scoring Jobs of up to batch_size passages each.
+
+    Each job makes a scoring and a prediction request (with top-k, a
+    prediction request and, if any candidate is missing from the top-k, a
+    scoring request) and returns a list of info dicts. Jobs are budgeted
+    for both requests, so the rate limiter never under-counts. With
+    max_batch_tokens, passages are bin-packed by token count so each job
+    uses at most max_batch_tokens (unless a single passage needs more).
+    """
+    tokens = passage_tokens(df_passages, c1, c2, model, vocab)
+
+    if max_batch_tokens:
+        groups = packing.pack(tokens, max_batch_tokens, max_items=batch_size)
+    else:
+        groups = [list(range(chunk_start, min(chunk_start + batch_size, len(tokens))))
+                  for chunk_start in range(0, len(tokens), batch_size)]
+
+    jobs = []
+    for group in groups:
+        df_chunk = df_passages.iloc[group]
+        group_tokens = sum(tokens[i] for i in group)
+        if top_k:
+            jobs.append(Job(score_passages_topk, (df_chunk, c1, c2, model, vocab, top_k),
+                            requests=2, tokens=group_tokens, tag=model))
+        else:
+            jobs.append(Job(score_passages, (df_chunk, c1, c2, model, vocab),
+                            requests=2, tokens=group_tokens, tag=model))
+
+    return jobs
+
+
+def dry_run(filename, c1, c2, models, batch_size=10, top_k=0,
+            max_batch_tokens=None, chunk_size=1000):
+    """Estimate requests, tokens and cost per model without calling the API.
+
+    Estimates are worst case (with top-k, every candidate echo-scored).
+    """
+    vocab = stims_vocab(filename, c1, c2, chunk_size)
+
+    totals = {model: {"model": model, "passages": 0, "requests": 0,
+                      "max_request_tokens": 0, "tokens": 0}
+              for model in models}
+    for df_chunk in iter_passages(filename, chunk_size):
+        for model in models:
+            jobs = make_jobs(df_chunk, c1, c2, model, vocab, batch_size, top_k,
+                             max_batch_tokens)
+            row = totals[model]
+            row["passages"] += len(df_chunk)
+            row["requests"] += sum(job.requests for job in jobs)
+            row["max_request_tokens"] = max([row["max_request_tokens"]]
+                                            + [job.tokens for job in jobs])
+            row["tokens"] += sum(job.tokens for job in jobs)
+
+    rows = []
+    for model, row in totals.items():
+        price = PRICE_PER_1K_TOKENS.get(model)
+        row["cost_usd"] = None if price is None else round(row["tokens"] / 1000 * price, 4)
+        rows.append(row)
+
+    df_estimate = pd.DataFrame(rows)
+    print(df_estimate.to_string(index=False))
+    print("Total cost (USD): {C}".format(C = df_estimate["cost_usd"].sum()))
+
+    return df_estimate
+
+
+def backend_concurrency(scorer, concurrency):
+    """concurrency, capped at what scorer can run at once."""
+    if scorer.max_concurrency:
+        return min(concurrency, scorer.max_concurrency)
+    return concurrency
+
+
+def count_retry(job, error):
+    """Scheduler on_retry callback: count retries per model."""
+    metrics.retry(job.tag)
+
+
+def run_jobs(jobs, total, journal, scheduler=None):
+    """Run scoring jobs, appending their infos to journal as they finish."""
+    scorer = get_backend()
+    scheduler = scheduler or Scheduler(
+        concurrency=backend_concurrency(scorer, 8),
+        retryable=scorer.is_retryable,
+        on_retry=count_retry)
+
+    def on_result(index, infos):
+        journal.append(infos)
+        pbar.update(len(infos))
+
+    # Keep finished results even if a job fails
+    try:
+        with tqdm(total=total) as pbar:
+            scheduler.run(jobs, on_result=on_result)
+    finally:
+        journal.flush()
+
+
+def journal_results(journal):
+    """Results dataframe from a journal, keeping the last record per item."""
+    df_results = pd.DataFrame(journal.records())
+    return df_results.drop_duplicates(["model", "item_id"], keep="last")
+
+
+def main(filename, c1, c2, model='ada', batch_size=10, top_k=0,
+         max_batch_tokens=None, resume=False, store="csv", scheduler=None,
+         chunk_size=1000):
+    """
+    Run GPT-3 (or another backend's model) on stims. 
+
+    Requires that filename name stims with "item_id" and "passage" columns, as well as 
+    columns for the two words (c1 vs. c2) to be comparing (e.g., start vs. end):
+    either templates in data/stims/{filename}_templates.json, which are
+    expanded lazily (see stimuli.py), or a data/stims/{filename}.csv file.
+    Stims are streamed chunk_size passages at a time, so they're never all
+    held in memory.
+
+    Passages are scored batch_size at a time (or bin-packed under
+    max_batch_tokens), with the c1/c2 variants of every passage in a batch
+    sent as a single list-valued prompt. Batches are run
+    concurrently by scheduler (a scheduler.Scheduler), which rate limits and
+    retries them.
+
+    Besides c1 and c2, every other c1/c2 word a passage mentions is scored
+    as a candidate (candidate_logprobs, cand_pred).
+
+    If top_k > 0, candidate logprobs are read from a single top-k prediction
+    request where possible (see score_passages_topk).
+
+    Results are appended to a journal as each batch completes, and the saved
+    table is assembled from it. With resume, items already in the journal
+    are not scored again.
+
+    With store="parquet" results are saved to the columnar result_store
+    (stims once, results partitioned by model and keyed by item_id); with
+    store="csv" (the default, as the R analyses read these) they're merged
+    with the stims into a per-model .csv.
+    Request usage, latency, retries and estimated cost are saved alongside
+    as a _run_report .json and Prometheus .prom file.
+
+    """
+
+    # Usnig which model?
+    print("Using model: {M}".format(M = model))
 
-            # Get passage
-            text = row['passage']
-            # Get substitutions for masked word
-            candidates = [row[c1], row[c2]]
-            # Get log odds for these words
-            info = log_odds_gpt3(text, row[c1], row[c2], -1, model=model)
+    # Journal results as they complete, skipping finished items on resume
+    journal = ResultJournal(
+        "data/processed/{TASK}_gpt3-{m}.journal.jsonl".format(TASK=filename, m=model),
+        resume=resume)
+    done = journal.done("item_id")
+
+    try:
+        # For each batch of passages, get log-odds of c1 vs. c2
+        vocab = stims_vocab(filename, c1, c2, chunk_size)
+        n_passages = 0
+        for df_chunk in iter_passages(filename, chunk_size):
+            df_todo = df_chunk[[(item_id,) not in done for item_id in df_chunk["item_id"]]]
+            jobs = make_jobs(df_todo, c1, c2, model, vocab, batch_size, top_k,
+                             max_batch_tokens)
+            run_jobs(jobs, len(df_todo), journal, scheduler)
+            n_passages += len(df_chunk)
+        print("#passages: {M}".format(M = n_passages))
+
+        # Create dataframe
+        df_results = journal_results(journal)
+    finally:
+        journal.close()
+
+    # Save results
+    if store == "parquet":
+        result_store.write_stimuli(filename, iter_passages(filename, chunk_size))
+        result_store.write_results(filename, model, df_results)
+    else:
+        # Add to stims, chunk by chunk
+        df_results = df_results.drop(columns=["model", "passage"])
+        write_csv_chunks(
+            (pd.merge(df_chunk, df_results, on = "item_id")
+             for df_chunk in iter_passages(filename, chunk_size)),
+            "data/processed/{TASK}_gpt3-{m}_surprisals_probs.csv".format(TASK=filename, m=model))
 
-            # Get predictions from model
-            tokens, token_logprobs = pred_tokens(text, n=2, model=model)
-            # Add to info dict
-            info["pred_t1"] = tokens[0].strip()
-            info["pred_t2"] = tokens[1].strip()
-            info["pred_lp1"] = token_logprobs[0]
-            info["pred_lp2"] = token_logprobs[1]
+    # Save usage, latency and cost report
+    metrics.write("data/processed/{TASK}_gpt3-{m}_run_report".format(TASK=filename, m=model))
 
-            # Add ratio to log-odds list
-            results.append(info)
 
-            ## Pause
-            if index == 250:
-                time.sleep(1)
-            elif index == 500:
-                time.sleep(1)
-            elif index == 750:
-                time.sleep(1)
+def sweep(filename, c1, c2, models, batch_size=10, top_k=0,
+          max_batch_tokens=None, resume=False, store="csv", scheduler=None,
+          chunk_size=1000):
+    """
+    Run several GPT-3 models on stims in a single pass.
 
-            pbar.update(1)
+    Stims are streamed once, and every model's jobs for a chunk of stims go
+    through one scheduler (so one work queue and rate limiter), interleaved
+    model by model so no single engine is hit with a long run of requests.
+    Results are saved as one long-format table keyed by (model, item_id),
+    assembled from a resumable journal and saved to store as in main()
+    (for store="csv", ordered by model and then stims).
 
-    # Create dataframe
-    df_results = pd.DataFrame(results)
-    # Add to dataframe
-    df_passages = pd.merge(df_passages, df_results, on = "passage")
+    """
 
-    # Save file
-    df_passages.to_csv("data/processed/{TASK}_gpt3-{m}_surprisals_probs.csv".format(TASK=filename, m=model))
+    print("Using models: {M}".format(M = ", ".join(models)))
+
+    # Journal results as they complete, skipping finished items on resume
+    journal = ResultJournal(
+        "data/processed/{TASK}_gpt3-sweep.journal.jsonl".format(TASK=filename),
+        resume=resume)
+    done = journal.done("model", "item_id")
+
+    try:
+        vocab = stims_vocab(filename, c1, c2, chunk_size)
+        n_passages = 0
+        for df_chunk in iter_passages(filename, chunk_size):
+            model_jobs = []
+            total = 0
+            for model in models:
+                df_todo = df_chunk[[(model, item_id) not in done
+                                    for item_id in df_chunk["item_id"]]]
+                model_jobs.append(make_jobs(df_todo, c1, c2, model, vocab, batch_size,
+                                            top_k, max_batch_tokens))
+                total += len(df_todo)
+
+            # Interleave jobs: batch 0 for each model, then batch 1, ...
+            jobs = [job for batch in zip_longest(*model_jobs) for job in batch
+                    if job is not None]
+
+            run_jobs(jobs, total, journal, scheduler)
+            n_passages += len(df_chunk)
+        print("#passages: {M}".format(M = n_passages))
+
+        # Create long-format dataframe
+        df_results = journal_results(journal)
+    finally:
+        journal.close()
+
+    # Save results
+    if store == "parquet":
+        result_store.write_stimuli(filename, iter_passages(filename, chunk_size))
+        for model, df_model in df_results.groupby("model"):
+            result_store.write_results(filename, model, df_model)
+    else:
+        df_results = df_results.drop(columns="passage")
+        write_csv_chunks(
+            (pd.merge(df_chunk, df_model, on = "item_id")
+             for _, df_model in df_results.groupby("model")
+             for df_chunk in iter_passages(filename, chunk_size)),
+            "data/processed/{TASK}_gpt3-sweep_surprisals_probs.csv".format(TASK=filename))
+
+    # Save usage, latency and cost report
+    metrics.write("data/processed/{TASK}_gpt3-sweep_run_report".format(TASK=filename))
 
 
 if __name__ == "__main__":
@@ -174,7 +643,98 @@ if __name__ == "__main__":
                         default="end")
     parser.add_argument("--m", type=str, dest="model",
                         default="davinci")
+    parser.add_argument("--models", type=str, nargs="+", dest="models",
+                        default=None)
+    parser.add_argument("--batch_size", type=int, dest="batch_size",
+                        default=10)
+    parser.add_argument("--max_batch_tokens", type=int, dest="max_batch_tokens",
+                        default=None)
+    parser.add_argument("--chunk_size", type=int, dest="chunk_size",
+                        default=1000)
+    parser.add_argument("--dry_run", action="store_true", dest="dry_run")
+    parser.add_argument("--top_k", type=int, dest="top_k",
+                        default=0)
+    parser.add_argument("--store", type=str, dest="store",
+                        choices=["parquet", "csv"], default="csv")
+    parser.add_argument("--resume", action="store_true", dest="resume")
+    parser.add_argument("--concurrency", type=int, dest="concurrency",
+                        default=8)
+    parser.add_argument("--rpm", type=int, dest="requests_per_minute",
+                        default=3000)
+    parser.add_argument("--tpm", type=int, dest="tokens_per_minute",
+                        default=250000)
+    parser.add_argument("--max_retries", type=int, dest="max_retries",
+                        default=6)
+    parser.add_argument("--backend", type=str, dest="backend",
+                        choices=["openai", "local"], default="openai")
+    parser.add_argument("--api_base", type=str, dest="api_base",
+                        default=None)
+    parser.add_argument("--weights_dir", type=str, dest="weights_dir",
+                        default="models")
+    parser.add_argument("--local_batch_size", type=int, dest="local_batch_size",
+                        default=8)
+    parser.add_argument("--cache", type=str, dest="cache_path",
+                        default="data/cache/completions.sqlite")
+    parser.add_argument("--no_cache", action="store_true", dest="no_cache")
+    parser.add_argument("--cache_max_mb", type=int, dest="cache_max_mb",
+                        default=512)
+    parser.add_argument("--import_cache", type=str, dest="import_cache",
+                        default=None)
+    parser.add_argument("--export_cache", type=str, dest="export_cache",
+                        default=None)
     
     args = vars(parser.parse_args())
     print(args)
-    main(**args)
\ No newline at end of file
+
+    # Only estimate tokens and cost
+    if args["dry_run"]:
+        dry_run(args["filename"], args["c1"], args["c2"],
+                args["models"] or [args["model"]], args["batch_size"],
+                args["top_k"], args["max_batch_tokens"], args["chunk_size"])
+        raise SystemExit
+    args.pop("dry_run")
+
+    # Set up scoring backend
+    backend_name = args.pop("backend")
+    api_base = args.pop("api_base")
+    weights_dir = args.pop("weights_dir")
+    local_batch_size = args.pop("local_batch_size")
+    if backend_name == "local":
+        backend = LocalBackend(weights_dir=weights_dir, batch_size=local_batch_size)
+    else:
+        backend = OpenAIBackend(api_base=api_base)
+
+    # Set up response cache
+    cache_path = args.pop("cache_path")
+    cache_max_mb = args.pop("cache_max_mb")
+    import_cache = args.pop("import_cache")
+    export_cache = args.pop("export_cache")
+    if not args.pop("no_cache"):
+        cache = CompletionCache(cache_path, max_bytes=cache_max_mb * 2**20)
+
+        if import_cache:
+            n = cache.import_bundle(import_cache)
+            print("Imported {N} cached responses".format(N = n))
+
+    # Set up rate limited scheduler
+    limiter = RateLimiter(
+        requests_per_minute=args.pop("requests_per_minute"),
+        tokens_per_minute=args.pop("tokens_per_minute"))
+    args["scheduler"] = Scheduler(
+        limiter=limiter,
+        concurrency=backend_concurrency(backend, args.pop("concurrency")),
+        max_retries=args.pop("max_retries"),
+        retryable=backend.is_retryable,
+        on_retry=count_retry)
+
+    # Sweep over several models, or run just one
+    models = args.pop("models")
+    if models:
+        args.pop("model")
+        sweep(models=models, **args)
+    else:
+        main(**args)
+
+    if cache is not None and export_cache:
+        n = cache.export_bundle(export_cache)
+        print("Exported {N} cached responses".format(N = n))
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""Asyncio scheduler for rate-limited scoring requests.
+
+Jobs are blocking callables (e.g. a batched Completion request) that run in
+worker threads. The scheduler bounds how many run at once, paces them with
+requests- and tokens-per-minute token buckets, retries transient failures
+with jittered exponential backoff, and returns results in input order.
+"""
+
+
+import asyncio
+import random
+import time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+
+# fn(*args) makes `requests` API calls consuming about `tokens` tokens;
+# tag labels the job (e.g. its model) for callbacks
+Job = namedtuple("Job", ["fn", "args", "requests", "tokens", "tag"],
+                 defaults=[(), 1, 0, None])
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate_per_minute."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        """Wait until amount tokens are available, then take them."""
+        # Never ask for more than a full bucket, or we'd wait forever
+        amount = min(amount, self.capacity)
+        self._refill()
+        while self.tokens < amount:
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= amount
+
+
+class RateLimiter:
+    """Requests- and tokens-per-minute limits (None means unlimited)."""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._buckets = None
+
+    def _get_buckets(self):
+        # Buckets are created lazily so they start full when a run starts
+        if self._buckets is None:
+            self._buckets = (
+                TokenBucket(self.requests_per_minute)
+                if self.requests_per_minute else None,
+                TokenBucket(self.tokens_per_minute)
+                if self.tokens_per_minute else None)
+        return self._buckets
+
+    async def acquire(self, requests=1, tokens=0):
+        """Wait for capacity for requests calls using tokens tokens."""
+        request_bucket, token_bucket = self._get_buckets()
+        if request_bucket is not None:
+            await request_bucket.acquire(requests)
+        if token_bucket is not None and tokens:
+            await token_bucket.acquire(tokens)
+
+
+class Scheduler:
+    """Run Jobs concurrently under a RateLimiter, retrying transient errors.
+
+    Args:
+        limiter (RateLimiter): Shared rate limits (None for unlimited)
+        concurrency (int): Max jobs in flight
+        max_retries (int): Retries per job before the error is raised
+        backoff (float): Base backoff in seconds, doubled each retry
+        max_backoff (float): Cap on a single backoff in seconds
+        retryable (callable): error -> bool, whether to retry an error
+        on_retry (callable): on_retry(job, error) is called before a retry
+    """
+
+    def __init__(self, limiter=None, concurrency=8, max_retries=6,
+                 backoff=1.0, max_backoff=60.0, retryable=None, on_retry=None):
+        self.limiter = limiter or RateLimiter()
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retryable = retryable or (lambda error: False)
+        self.on_retry = on_retry
+
+    async def _run_job(self, job, semaphore, executor):
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            async with semaphore:
+                await self.limiter.acquire(job.requests, job.tokens)
+                try:
+                    return await loop.run_in_executor(
+                        executor, lambda: job.fn(*job.args))
+                except Exception as error:
+                    if attempt >= self.max_retries or not self.retryable(error):
+                        raise
+                    if self.on_retry is not None:
+                        self.on_retry(job, error)
+
+            # Full jitter: sleep anywhere up to the exponential backoff
+            delay = min(self.max_backoff, self.backoff * 2**attempt)
+            await asyncio.sleep(random.uniform(0, delay))
+            attempt += 1
+
+    async def _run_all(self, jobs, on_result):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_indexed(index, job):
+            result = await self._run_job(job, semaphore, executor)
+            if on_result is not None:
+                on_result(index, result)
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return await asyncio.gather(
+                *[run_indexed(i, job) for i, job in enumerate(jobs)])
+
+    def run(self, jobs, on_result=None):
+        """Run jobs and return their results in input order.
+
+        on_result(index, result) is called as each job finishes, in
+        completion order.
+        """
+        return asyncio.run(self._run_all(list(jobs), on_result))
@@ -0,0 +1,327 @@
+"""Template-driven stimulus generation.
+
+Each item is a passage template crossed with the experiment's factors
+(condition x first_mention x recent_mention x knowledge_cue). Templates
+live in data/stims/{task}_templates.json:
+
+    {"factors": [{"name": "first_mention", "levels": [["s", "Start"], ...]},
+                 ...],
+     "id_format": "{item}_{condition}_1_{first_mention}_...",
+     "columns": [...],
+     "items": [{"item": 7, "start": "garage", "end": "fridge", ...,
+                "passage": ["David and Marta ...",
+                            {"by": ["first_mention"],
+                             "text": {"s": "stores the wine ...", "e": ...}},
+                            ...]}]}
+
+A text column is either a plain string, the same for every condition, or
+a list of parts: literal strings and slots whose text depends on the
+levels of the factors listed in "by" (keyed by level codes joined with
+"_"). generate() expands items x conditions lazily, one row at a time, so
+the stims never need to be held in memory (or maintained by hand).
+
+Run as a script to extract templates from an existing stims .csv, or to
+export the generated stims to data/stims/{task}.csv and the experiment's
+data/expt/nlm_fb_stimuli.csv.
+"""
+
+
+import csv
+import difflib
+import itertools
+import json
+import re
+
+
+# Columns computed from the passage and factor levels rather than templated
+DERIVED_COLUMNS = ["row", "item_id", "mentions_start", "mentions_end",
+                   "mentions_ratio", "passage_reversed", "start_reversed",
+                   "end_reversed", "passage_hr", "critical_q"]
+
+# Aligned runs shorter than this many tokens are folded into the slots
+# around them, so slots are whole phrases rather than fragments
+MIN_LITERAL_TOKENS = 4
+
+TOKEN_RE = re.compile(r"\s+|\w+|[^\w\s]")
+
+
+def templates_path(task):
+    return "data/stims/{TASK}_templates.json".format(TASK=task)
+
+
+def load_templates(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_templates(templates, path):
+    with open(path, "w") as f:
+        json.dump(templates, f, indent=2)
+        f.write("\n")
+
+
+def conditions(templates):
+    """Every combination of factor levels, as {factor: code} dicts."""
+    factors = templates["factors"]
+    for codes in itertools.product(*[[code for code, _ in factor["levels"]]
+                                     for factor in factors]):
+        yield {factor["name"]: code for factor, code in zip(factors, codes)}
+
+
+def fill(parts, levels):
+    """Text of a templated column for the given factor levels."""
+    if not isinstance(parts, list):
+        return parts
+
+    text = []
+    for part in parts:
+        if isinstance(part, str):
+            text.append(part)
+        else:
+            text.append(part["text"]["_".join(levels[f] for f in part["by"])])
+    return "".join(text)
+
+
+def _split_probe(passage):
+    """(passage_hr, critical_q): the passage before the final [MASK]
+    sentence, and that sentence up to the [MASK]."""
+    passage_hr, probe = passage.rsplit(". ", 1)
+    return passage_hr + ".", probe.replace(" [MASK].", "")
+
+
+def generate(templates, items=None):
+    """Lazily expand templates into stimulus rows (dicts).
+
+    Args:
+        templates (dict): Loaded templates (see module docstring)
+        items (list): Only expand these items (None for all)
+
+    Yields:
+        row (dict): One stimulus, with templates["columns"] as keys
+    """
+    labels = {factor["name"]: dict(factor["levels"])
+              for factor in templates["factors"]}
+    columns = templates["columns"]
+
+    row = 0
+    for item in templates["items"]:
+        if items is not None and item["item"] not in items:
+            continue
+
+        for levels in conditions(templates):
+            stim = {column: fill(item[column], levels)
+                    for column in columns
+                    if column in item and column not in DERIVED_COLUMNS}
+            stim.update({name: labels[name][code] for name, code in levels.items()})
+
+            passage = stim["passage"]
+            n_start = passage.count(stim["start"])
+            n_end = passage.count(stim["end"])
+            ratio = n_start / n_end if n_end else None
+            passage_hr, critical_q = _split_probe(passage)
+
+            stim.update({
+                "row": row,
+                "item_id": templates["id_format"].format(item=item["item"], **levels),
+                "mentions_start": n_start,
+                "mentions_end": n_end,
+                "mentions_ratio": (int(ratio) if ratio is not None
+                                   and ratio.is_integer() else ratio),
+                "passage_reversed": passage[::-1],
+                "start_reversed": stim["start"][::-1],
+                "end_reversed": stim["end"][::-1],
+                "passage_hr": passage_hr,
+                "critical_q": critical_q,
+            })
+            row += 1
+
+            yield {column: stim[column] for column in columns}
+
+
+def chunks(rows, size):
+    """Group a stream of rows into lists of up to size rows."""
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def write_csv(rows, path, columns, index_label="row"):
+    """Stream rows to a .csv, numbering them in the first (index) column.
+
+    Returns the number of rows written.
+    """
+    n = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([index_label] + [c for c in columns if c != "row"])
+        for n, row in enumerate(rows, 1):
+            writer.writerow([n - 1] + [row[c] for c in columns if c != "row"])
+    return n
+
+
+def _slot(values, factors):
+    """Slot (or literal) for text that varies with the factor levels.
+
+    values maps each condition (a tuple of codes, in factors order) to its
+    text; the slot is keyed by the fewest factors that determine it.
+    """
+    for n in range(len(factors) + 1):
+        for by in itertools.combinations(range(len(factors)), n):
+            text = {}
+            for codes, value in values.items():
+                key = "_".join(codes[i] for i in by)
+                if text.setdefault(key, value) != value:
+                    break
+            else:
+                if not by:
+                    return text[""]
+                return {"by": [factors[i] for i in by], "text": text}
+
+
+def extract_parts(texts, factors):
+    """Template parts reproducing texts ({condition codes: text}).
+
+    Token runs shared by every text (aligned against the longest) become
+    literals, and the text between them becomes slots.
+    """
+    tokenized = {codes: TOKEN_RE.findall(text) for codes, text in texts.items()}
+    base = max(tokenized.values(), key=len)
+
+    # Base tokens matched in every text, and where they map to in each
+    shared = [True] * len(base)
+    mapping = {}
+    for codes, tokens in tokenized.items():
+        matcher = difflib.SequenceMatcher(None, base, tokens, autojunk=False)
+        mapped = {}
+        for a, b, size in matcher.get_matching_blocks():
+            for k in range(size):
+                mapped[a + k] = b + k
+        mapping[codes] = mapped
+        shared = [s and i in mapped for i, s in enumerate(shared)]
+
+    # Runs of base tokens that are shared, and contiguous, in every text
+    literals = []
+    start = None
+    for i in range(len(base) + 1):
+        if (start is not None and i < len(base) and shared[i]
+                and all(m[i] == m[i - 1] + 1 for m in mapping.values())):
+            continue
+        if start is not None and i - start >= MIN_LITERAL_TOKENS:
+            literals.append((start, i))
+        start = i if i < len(base) and shared[i] else None
+
+    parts = []
+    previous = {codes: 0 for codes in texts}
+    for lit_start, lit_end in literals + [(None, None)]:
+        values = {}
+        for codes, tokens in tokenized.items():
+            end = len(tokens) if lit_start is None else mapping[codes][lit_start]
+            values[codes] = "".join(tokens[previous[codes]:end])
+            if lit_start is not None:
+                previous[codes] = mapping[codes][lit_end - 1] + 1
+
+        # Split slots depending on several factors further, where the
+        # variants still share text (e.g. a sentence that moves)
+        slot = _slot(values, factors)
+        if literals and isinstance(slot, dict) and len(slot["by"]) > 1:
+            sub_parts = extract_parts(values, factors)
+            if len(sub_parts) > 1:
+                parts.extend(sub_parts)
+                slot = None
+        if slot:
+            parts.append(slot)
+        if lit_start is not None:
+            parts.append("".join(base[lit_start:lit_end]))
+
+    # Merge adjacent literals
+    merged = []
+    for part in parts:
+        if merged and isinstance(part, str) and isinstance(merged[-1], str):
+            merged[-1] += part
+        else:
+            merged.append(part)
+    return merged
+
+
+def extract_templates(path, factors, id_format):
+    """Build templates from an existing stims .csv.
+
+    Args:
+        path (str): Stims .csv, with one row per item x condition
+        factors (list): [{"name": ..., "levels": [[code, label], ...]}, ...]
+        id_format (str): item_id format, with {item} and a {factor} per factor
+
+    Returns:
+        templates (dict): Templates that generate() expands back into the
+            stims' rows
+    """
+    names = [factor["name"] for factor in factors]
+    codes = {factor["name"]: {label: code for code, label in factor["levels"]}
+             for factor in factors}
+
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        columns = list(reader.fieldnames)
+        by_item = {}
+        for row in reader:
+            condition = tuple(codes[name][row[name]] for name in names)
+            by_item.setdefault(row["item"], {})[condition] = row
+
+    templated = [c for c in columns if c not in DERIVED_COLUMNS + names]
+
+    items = []
+    for item, rows in by_item.items():
+        template = {}
+        for column in templated:
+            texts = {condition: row[column] for condition, row in rows.items()}
+            if len(set(texts.values())) == 1:
+                template[column] = next(iter(texts.values()))
+            else:
+                template[column] = extract_parts(texts, names)
+        template["item"] = int(item)
+        items.append(template)
+
+    return {"factors": factors, "id_format": id_format,
+            "columns": columns, "items": items}
+
+
+# Factors of the false belief stims, in the order rows are expanded
+FB_FACTORS = [
+    {"name": "first_mention", "levels": [["s", "Start"], ["e", "End"]]},
+    {"name": "recent_mention", "levels": [["e", "End"], ["s", "Start"]]},
+    {"name": "condition", "levels": [["fb", "False Belief"], ["tb", "True Belief"]]},
+    {"name": "knowledge_cue", "levels": [["ex", "Explicit"], ["im", "Implicit"]]},
+]
+FB_ID_FORMAT = "{item}_{condition}_1_{first_mention}_{recent_mention}_{knowledge_cue}"
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+
+    parser.add_argument("--path", type=str, dest="task",
+                        default="fb")
+    parser.add_argument("--extract", action="store_true", dest="extract")
+    parser.add_argument("--expt", type=str, dest="expt",
+                        default="data/expt/nlm_fb_stimuli.csv")
+
+    args = parser.parse_args()
+
+    if args.extract:
+        # One-off: templates from the hand-made stims
+        templates = extract_templates(
+            "data/stims/{TASK}.csv".format(TASK=args.task), FB_FACTORS, FB_ID_FORMAT)
+        save_templates(templates, templates_path(args.task))
+        print("#items: {N}".format(N = len(templates["items"])))
+
+    # Export the generated stims for scoring and for the experiment
+    templates = load_templates(templates_path(args.task))
+    columns = templates["columns"]
+    n = write_csv(generate(templates),
+                  "data/stims/{TASK}.csv".format(TASK=args.task), columns)
+    write_csv(generate(templates), args.expt, columns, index_label="")
+    print("#passages: {N}".format(N = n))